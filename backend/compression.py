@@ -0,0 +1,260 @@
+"""
+Response compression and static asset caching for Accessible Notebooks.
+
+API responses are compressed on the fly when they are large enough to be
+worth it. Frontend files are read, hashed and precompressed once at startup,
+so serving them costs nothing more than picking the right variant.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent as-is; compressing them saves
+# almost nothing and costs CPU on both ends.
+MIN_COMPRESS_BYTES = 1024
+
+COMPRESSIBLE_TYPES = {
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml',
+}
+
+# Long-lived caching for asset URLs that carry the current content hash.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+ASSET_REFERENCE = re.compile(r'(src|href)="([^"?#:]+)"')
+
+
+def supported_encodings():
+    """Encodings we can produce, most preferred first."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick the best content encoding the client accepts.
+
+    Args:
+        accept_encoding: Value of the Accept-Encoding request header
+
+    Returns:
+        'br', 'gzip', or None for an uncompressed response
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        fields = part.strip().split(';')
+        name = fields[0].strip().lower()
+        quality = 1.0
+        for param in fields[1:]:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name] = quality
+
+    for encoding in supported_encodings():
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding, static=False):
+    """
+    Compress bytes with the given encoding.
+
+    Args:
+        data: Bytes to compress
+        encoding: 'br' or 'gzip'
+        static: Use maximum compression (for data compressed once at startup)
+
+    Returns:
+        Compressed bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if static else 5)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9 if static else 6)
+    raise ValueError(f'Unsupported encoding: {encoding}')
+
+
+def is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+def compress_response(response, accept_encoding):
+    """
+    Compress a dynamic response in place if the client accepts it and the
+    body is large enough.
+
+    Streamed and file responses, and anything already encoded, are left alone.
+
+    Returns:
+        The (possibly modified) response
+    """
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    if 'Content-Encoding' in response.headers:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if not is_compressible(response.mimetype):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_BYTES:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class StaticAsset:
+    """
+    One frontend file held in memory with its precompressed variants.
+    """
+
+    def __init__(self, path, data, mimetype):
+        self.path = path
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+        self.variants = {None: data}
+
+        if is_compressible(mimetype) and len(data) >= MIN_COMPRESS_BYTES:
+            for encoding in supported_encodings():
+                compressed = compress(data, encoding, static=True)
+                if len(compressed) < len(data):
+                    self.variants[encoding] = compressed
+
+
+class StaticAssetCache:
+    """
+    Reads, hashes and precompresses the frontend directory once at startup.
+
+    HTML pages have their asset references rewritten to content-hashed URLs
+    (e.g. app.js?v=<hash>), so those URLs can be cached forever: any change
+    to a file changes its URL. The pages themselves are always revalidated
+    with an ETag.
+    """
+
+    def __init__(self, directory, allowed_extensions):
+        self.directory = directory
+        self.allowed_extensions = allowed_extensions
+        self.assets = {}
+
+    def load(self):
+        """
+        (Re)build the cache from disk.
+
+        Returns:
+            Number of files cached
+        """
+        assets = {}
+        pages = []
+
+        for root, dirs, files in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for filename in files:
+                ext = os.path.splitext(filename)[1].lower()
+                if ext not in self.allowed_extensions:
+                    continue
+                full_path = os.path.join(root, filename)
+                path = os.path.relpath(full_path, self.directory).replace(os.sep, '/')
+                if ext == '.html':
+                    pages.append((path, full_path))
+                    continue
+                with open(full_path, 'rb') as f:
+                    assets[path] = StaticAsset(path, f.read(), self._mimetype(path))
+
+        # Pages are hashed after rewriting so their ETag follows their assets.
+        for path, full_path in pages:
+            with open(full_path, 'r', encoding='utf-8') as f:
+                html = self._rewrite_references(f.read(), path, assets)
+            assets[path] = StaticAsset(path, html.encode('utf-8'), 'text/html')
+
+        self.assets = assets
+        return len(assets)
+
+    def send(self, path, request):
+        """
+        Build a response for a cached asset.
+
+        Args:
+            path: Path relative to the frontend directory
+            request: The current Flask request
+
+        Returns:
+            A Flask response, or None if the path is not cached
+        """
+        asset = self.assets.get(path)
+        if asset is None:
+            return None
+
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding not in asset.variants:
+            encoding = None
+        data = asset.variants[encoding]
+
+        response = Response(data, mimetype=asset.mimetype)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if len(asset.variants) > 1:
+            response.vary.add('Accept-Encoding')
+
+        # Each encoding is a different byte sequence, so it gets its own ETag.
+        response.set_etag(f'{asset.digest}-{encoding}' if encoding else asset.digest)
+
+        if request.args.get('v') == asset.digest:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+
+        return response.make_conditional(request)
+
+    def _rewrite_references(self, html, page_path, assets):
+        base = os.path.dirname(page_path)
+
+        def replace(match):
+            attribute, reference = match.groups()
+            path = os.path.normpath(os.path.join(base, reference)).replace(os.sep, '/')
+            asset = assets.get(path)
+            if asset is None:
+                return match.group(0)
+            return f'{attribute}="{reference}?v={asset.digest}"'
+
+        return ASSET_REFERENCE.sub(replace, html)
+
+    @staticmethod
+    def _mimetype(path):
+        if path.endswith('.js'):
+            return 'text/javascript'
+        mimetype, _ = mimetypes.guess_type(path)
+        return mimetype or 'application/octet-stream'
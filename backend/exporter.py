@@ -0,0 +1,487 @@
+"""
+Export of notebooks to accessible HTML and plain text.
+
+Exports run on a small worker pool so request threads only queue them.
+Each cell is rendered on its own and the fragment cached by the cell's
+content hash; a finished export is cached by the hash of all its cells.
+Re-exporting after a small edit therefore renders only the edited cells,
+and re-exporting an unchanged notebook renders nothing.
+"""
+
+import hashlib
+import html
+import json
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+from output_store import BLOB_METADATA_KEY, join_text
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+FORMATS = {
+    'html': {'extension': 'html', 'mimetype': 'text/html'},
+    'text': {'extension': 'txt', 'mimetype': 'text/plain'}
+}
+
+EXPORT_WORKERS = 2
+
+# Rendered cell fragments kept in memory, across all notebooks and formats
+MAX_CACHED_FRAGMENTS = 5000
+
+# Finished jobs remembered for status queries
+MAX_FINISHED_JOBS = 100
+
+# The least recently used exports are deleted once they take up more than this
+MAX_EXPORT_BYTES = 256 * 1024 * 1024
+
+# Cells are read from stored notebooks this many at a time
+CELL_PAGE_SIZE = 200
+
+INLINE_IMAGE_TYPES = ('image/png', 'image/jpeg', 'image/gif')
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+# HTML kept from markdown cells; anything else is dropped (its text is kept)
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'dd', 'del', 'details', 'div',
+    'dl', 'dt', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'kbd',
+    'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub', 'summary', 'sup',
+    'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul'
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+# Tags dropped together with everything inside them
+DROPPED_CONTENT_TAGS = {'script', 'style', 'template', 'iframe', 'object', 'noscript', 'svg', 'math'}
+ALLOWED_ATTRIBUTES = {
+    '*': {'class', 'title'},
+    'a': {'href'},
+    'img': {'src', 'alt', 'width', 'height'},
+    'td': {'align', 'colspan', 'rowspan'},
+    'th': {'align', 'colspan', 'rowspan', 'scope'}
+}
+URL_ATTRIBUTES = {'href', 'src'}
+SAFE_URL_SCHEMES = {'http', 'https', 'mailto'}
+URL_SCHEME = re.compile(r'^([a-zA-Z][a-zA-Z0-9+.-]*):')
+SAFE_DATA_URL = re.compile(r'^data:image/(png|jpeg|gif);base64,', re.IGNORECASE)
+EXPORT_FILENAME = re.compile(r'^[0-9a-f]{64}\.(html|txt)$')
+
+HTML_HEAD = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; font-size: 18px; line-height: 1.6; max-width: 60em; margin: 0 auto; padding: 20px; }}
+pre {{ white-space: pre-wrap; word-wrap: break-word; border: 2px solid #666; padding: 10px; }}
+.output pre {{ background-color: #f5f5f5; }}
+.error pre {{ background-color: #ffebee; }}
+</style>
+</head>
+<body>
+<main>
+<h1>{title}</h1>
+'''
+
+HTML_FOOT = '''</main>
+</body>
+</html>
+'''
+
+
+def is_safe_url(url, attribute):
+    # Browsers ignore whitespace and control characters inside a scheme
+    compact = re.sub(r'[\x00-\x20]', '', url)
+    match = URL_SCHEME.match(compact)
+    if match is None:
+        return True
+    if attribute == 'src' and SAFE_DATA_URL.match(compact):
+        return True
+    return match.group(1).lower() in SAFE_URL_SCHEMES
+
+
+class _HTMLSanitizer(HTMLParser):
+    """Rebuilds HTML keeping only allowlisted tags, attributes and URLs."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+
+        allowed = ALLOWED_ATTRIBUTES['*'] | ALLOWED_ATTRIBUTES.get(tag, set())
+        kept = ''.join(
+            f' {name}="{html.escape(value)}"'
+            for name, value in attrs
+            if name in allowed and value is not None
+            and (name not in URL_ATTRIBUTES or is_safe_url(value, name))
+        )
+        self.parts.append(f'<{tag}{kept}>')
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in DROPPED_CONTENT_TAGS:
+            self.handle_starttag(tag, attrs)
+            if tag in self.open_tags and tag not in VOID_TAGS:
+                self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # Close anything left open inside it too
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.parts.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(html.escape(data, quote=False))
+
+    def result(self):
+        self.close()
+        return ''.join(self.parts) + ''.join(f'</{tag}>' for tag in reversed(self.open_tags))
+
+
+def sanitize_html(fragment):
+    """
+    Keep only allowlisted tags and attributes, and drop unsafe URLs.
+
+    Markdown cells may contain raw HTML, which must not carry scripts into
+    an export.
+    """
+    sanitizer = _HTMLSanitizer()
+    sanitizer.feed(fragment)
+    return sanitizer.result()
+
+
+def cell_digest(cell):
+    return hashlib.sha256(json.dumps(cell, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def output_text(output):
+    """Readable text of one nbformat output, or '' if it has none."""
+    output_type = output.get('output_type')
+    if output_type == 'stream':
+        return join_text(output.get('text', ''))
+    if output_type in ('execute_result', 'display_data'):
+        return join_text(output.get('data', {}).get('text/plain', ''))
+    if output_type == 'error':
+        return ANSI_ESCAPE.sub('', '\n'.join(output.get('traceback', [])))
+    return ''
+
+
+class CellRenderer:
+    """
+    Renders single cells to HTML or text fragments.
+
+    render() output depends only on the cell, so it can be cached by the
+    cell's content; wrap() then adds what depends on the cell's place in
+    the notebook (a code cell's number).
+    """
+
+    def __init__(self, blob_store):
+        self.blob_store = blob_store
+
+    def render(self, cell, fmt):
+        if fmt == 'html':
+            return self.render_html(cell)
+        return self.render_text(cell)
+
+    def wrap(self, cell, number, fmt, fragment):
+        """Add a code cell's numbered heading or label to its rendered fragment."""
+        if cell.get('cell_type') != 'code':
+            return fragment
+
+        count = cell.get('execution_count')
+        if fmt == 'html':
+            label = f'Code cell {number}'
+            if count is not None:
+                label += f', execution {count}'
+            return f'<section class="code" aria-label="{html.escape(label)}">\n{fragment}\n</section>\n'
+        return f'In [{count if count is not None else " "}], code cell {number}:\n{fragment}\n\n'
+
+    def render_html(self, cell):
+        source = join_text(cell.get('source', ''))
+        cell_type = cell.get('cell_type')
+
+        if cell_type == 'markdown':
+            if markdown is not None:
+                body = sanitize_html(markdown.markdown(source, extensions=['fenced_code', 'tables']))
+            else:
+                body = f'<pre>{html.escape(source)}</pre>'
+            return f'<section class="markdown">\n{body}\n</section>\n'
+
+        if cell_type == 'raw':
+            return f'<section class="raw">\n<pre>{html.escape(source)}</pre>\n</section>\n'
+
+        parts = [f'<pre><code>{html.escape(source)}</code></pre>']
+
+        for output in cell.get('outputs', []):
+            error = output.get('output_type') == 'error'
+            text = output_text(output)
+            image = self._image(output)
+            if not text and image is None:
+                continue
+
+            parts.append(f'<div class="output{" error" if error else ""}" role="group" aria-label="{"Error" if error else "Output"}">')
+            if image is not None:
+                mimetype, data = image
+                alt = html.escape(text or 'Output image')
+                parts.append(f'<img src="data:{mimetype};base64,{data}" alt="{alt}">')
+            else:
+                parts.append(f'<pre>{html.escape(text)}</pre>')
+            parts.append('</div>')
+
+        return '\n'.join(parts)
+
+    def render_text(self, cell):
+        source = join_text(cell.get('source', ''))
+        cell_type = cell.get('cell_type')
+
+        if cell_type != 'code':
+            return source.rstrip('\n') + '\n\n'
+
+        lines = [source.rstrip('\n')]
+        for output in cell.get('outputs', []):
+            text = output_text(output).rstrip('\n')
+            if text:
+                lines.append('Error:' if output.get('output_type') == 'error' else 'Output:')
+                lines.append(text)
+        return '\n'.join(lines)
+
+    def _image(self, output):
+        """(mimetype, base64 data) of an image in the output, from the blob cache if moved there."""
+        data = output.get('data', {})
+        blobs = output.get('metadata', {}).get(BLOB_METADATA_KEY, {})
+        for mimetype in INLINE_IMAGE_TYPES:
+            if mimetype in data:
+                return mimetype, join_text(data[mimetype]).replace('\n', '')
+            if mimetype in blobs and self.blob_store is not None:
+                blob = self.blob_store.get(blobs[mimetype])
+                if blob is not None:
+                    return mimetype, join_text(blob['data']).replace('\n', '')
+        return None
+
+
+class NotebookExporter:
+    """
+    Queues exports on a worker pool and caches their results.
+
+    Finished exports are files named by content hash. Like blobs, they are
+    touched when reused or downloaded, and the least recently used are
+    deleted once the directory is over max_bytes.
+    """
+
+    def __init__(self, notebook_store, blob_store, directory, workers=EXPORT_WORKERS,
+                 max_bytes=MAX_EXPORT_BYTES):
+        self.notebook_store = notebook_store
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Total size of the finished exports, measured on first use
+        self._total = None
+        self.renderer = CellRenderer(blob_store)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+        self._fragments = OrderedDict()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fmt, name=None, notebook=None):
+        """
+        Queue an export of a stored notebook (by name) or of notebook data.
+
+        Args:
+            fmt: 'html' or 'text'
+            name: Name of a notebook in the notebook store
+            notebook: nbformat notebook dict, used when name is None
+
+        Returns:
+            The job's status dict (see job_status)
+        """
+        job_id = uuid.uuid4().hex
+        title = name or (notebook or {}).get('metadata', {}).get('title') or 'Notebook'
+        future = self.pool.submit(self._export, fmt, name, notebook, title)
+
+        with self._lock:
+            self._jobs[job_id] = future
+            self._forget_finished_jobs()
+
+        return self.job_status(job_id)
+
+    def job_status(self, job_id):
+        """
+        Returns:
+            dict with 'status', 'job_id', 'state' ('pending', 'done' or
+            'error') and, when done, 'filename'; None for unknown jobs
+        """
+        with self._lock:
+            future = self._jobs.get(job_id)
+        if future is None:
+            return None
+
+        status = {'status': 'ok', 'job_id': job_id}
+        if not future.done():
+            status['state'] = 'pending'
+        elif future.exception() is not None:
+            status['state'] = 'error'
+            status['message'] = str(future.exception())
+        else:
+            status['state'] = 'done'
+            status['filename'] = future.result()
+        return status
+
+    def export_path(self, filename):
+        """Path of a finished export, or None if filename is not one."""
+        if not EXPORT_FILENAME.match(filename):
+            return None
+        path = os.path.join(self.directory, filename)
+        if not os.path.exists(path):
+            return None
+        self._touch(path)
+        return path
+
+    def _export(self, fmt, name, notebook, title):
+        extension = FORMATS[fmt]['extension']
+
+        # Pass 1: hash every cell, so an unchanged notebook costs no rendering
+        digests = [cell_digest(cell) for cell in self._cells(name, notebook)]
+        notebook_digest = hashlib.sha256(
+            json.dumps([fmt, title, digests]).encode('utf-8')
+        ).hexdigest()
+        filename = f'{notebook_digest}.{extension}'
+        path = os.path.join(self.directory, filename)
+        if os.path.exists(path):
+            self._touch(path)
+            return filename
+
+        # Pass 2: assemble, rendering only cells not already cached
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                if fmt == 'html':
+                    f.write(HTML_HEAD.format(title=html.escape(title)))
+                else:
+                    f.write(f'{title}\n{"=" * len(title)}\n\n')
+
+                code_number = 0
+                for cell, digest in zip(self._cells(name, notebook), digests):
+                    if cell.get('cell_type') == 'code':
+                        code_number += 1
+                    fragment = self._fragment(cell, digest, fmt)
+                    f.write(self.renderer.wrap(cell, code_number, fmt, fragment))
+
+                if fmt == 'html':
+                    f.write(HTML_FOOT)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        with self._lock:
+            self._measure()
+            self._total += os.path.getsize(path)
+            if self._total > self.max_bytes:
+                self._prune(keep=path)
+
+        return filename
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _exports(self):
+        """(mtime, size, path) of every finished export."""
+        exports = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return exports
+        for entry in entries:
+            if EXPORT_FILENAME.match(entry.name):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                exports.append((stat.st_mtime, stat.st_size, entry.path))
+        return exports
+
+    def _measure(self):
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self._exports())
+
+    def _prune(self, keep):
+        """Delete the least recently used exports until under max_bytes."""
+        exports = sorted(self._exports())
+        self._total = sum(size for _, size, _ in exports)
+        for _, size, path in exports:
+            if self._total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total -= size
+
+    def _cells(self, name, notebook):
+        """Cells of the notebook, read page by page for stored notebooks."""
+        if name is None:
+            yield from notebook.get('cells', [])
+            return
+
+        offset = 0
+        while True:
+            page = self.notebook_store.get_cells(name, offset, CELL_PAGE_SIZE)
+            if page is None:
+                raise ValueError(f'No stored notebook named {name}')
+            yield from page['cells']
+            offset += len(page['cells'])
+            if not page['cells'] or offset >= page['total']:
+                return
+
+    def _fragment(self, cell, digest, fmt):
+        # Fragments do not depend on the cell's position, so inserting or
+        # deleting a cell leaves every other cell's fragment cached
+        key = (fmt, digest)
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                return fragment
+
+        fragment = self.renderer.render(cell, fmt)
+
+        with self._lock:
+            self._fragments[key] = fragment
+            while len(self._fragments) > MAX_CACHED_FRAGMENTS:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def _forget_finished_jobs(self):
+        finished = [job_id for job_id, future in self._jobs.items() if future.done()]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
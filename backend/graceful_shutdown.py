@@ -0,0 +1,132 @@
+"""
+Graceful shutdown for Accessible Notebooks.
+
+On SIGTERM or SIGINT the server stops taking new executions, gives the
+ones already running a little while to finish, then shuts down every
+kernel it manages at the same time, rather than one after another.
+A second signal skips the wait.
+"""
+
+import _thread
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds running executions get to finish once shutdown begins
+DRAIN_TIMEOUT = 10
+
+
+class GracefulShutdown:
+    """
+    Tracks in-flight executions and runs shutdown tasks once.
+    """
+
+    def __init__(self, drain_timeout=DRAIN_TIMEOUT):
+        self.drain_timeout = drain_timeout
+        self._active = 0
+        self._condition = threading.Condition()
+        self._draining = False
+        self._force = threading.Event()
+        self._started = False
+        self._finished = threading.Event()
+        # Callables run in parallel once draining ends (e.g. kernel shutdowns)
+        self.parallel_tasks = []
+        # Callables run afterwards, in order
+        self.final_tasks = []
+
+    @property
+    def draining(self):
+        return self._draining
+
+    def begin(self):
+        """
+        Mark an execution as started.
+
+        Returns:
+            False if the server is shutting down and the execution must not start
+        """
+        with self._condition:
+            if self._draining:
+                return False
+            self._active += 1
+            return True
+
+    def end(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def install_signal_handlers(self):
+        """Shut down gracefully on SIGTERM and SIGINT. Call from the main thread."""
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        if self._finished.is_set():
+            # Leave the server loop; atexit handlers find nothing left to do
+            sys.exit(0)
+        if self._draining:
+            self._force.set()
+            return
+
+        # Drain on another thread: the main thread keeps accepting requests,
+        # so new executions get a 503 instead of a dropped connection
+        print(f'\nReceived {signal.Signals(signum).name}; shutting down')
+        threading.Thread(target=self._shutdown_and_exit, name='shutdown').start()
+
+    def _shutdown_and_exit(self):
+        self.shutdown()
+        try:
+            # Runs _handle_signal again, in the main thread
+            _thread.interrupt_main(signal.SIGINT)
+        except TypeError:
+            # Before Python 3.10 interrupt_main takes no signal and raises
+            # KeyboardInterrupt in the main thread instead; the caller of
+            # the server loop must catch it
+            _thread.interrupt_main()
+
+    def shutdown(self):
+        """
+        Refuse new executions, wait for running ones (up to drain_timeout),
+        then run the shutdown tasks. Only the first call does anything.
+        """
+        with self._condition:
+            if self._started:
+                return
+            self._started = True
+            self._draining = True
+
+        deadline = time.monotonic() + self.drain_timeout
+        with self._condition:
+            while self._active > 0 and not self._force.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f'Shutting down with {self._active} execution(s) still running')
+                    break
+                self._condition.wait(min(remaining, 0.5))
+
+        if self.parallel_tasks:
+            try:
+                with ThreadPoolExecutor(max_workers=len(self.parallel_tasks)) as pool:
+                    futures = [pool.submit(self._run_task, task) for task in self.parallel_tasks]
+                for future in futures:
+                    future.result()
+            except RuntimeError:
+                # From atexit, once the interpreter is exiting, no new work
+                # can be scheduled on threads; run the tasks one by one
+                for task in self.parallel_tasks:
+                    self._run_task(task)
+
+        for task in self.final_tasks:
+            self._run_task(task)
+
+        self._finished.set()
+
+    @staticmethod
+    def _run_task(task):
+        try:
+            task()
+        except Exception as e:
+            print(f'Shutdown task failed: {e}')
@@ -0,0 +1,229 @@
+"""
+Execution history for Accessible Notebooks.
+
+Every execution is appended to a local SQLite database: which code ran,
+in which kernel session, when, how long it took, and how it ended, with a
+truncated copy of its output. Recording only puts the entry on a queue; a
+background thread writes entries in batches, so execution never waits on
+the disk.
+"""
+
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+
+# Characters of output kept per execution
+MAX_OUTPUT_CHARS = 2000
+
+# Writer batching: write when this many entries are waiting, or this many
+# seconds after the first one arrived
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.5
+
+# The oldest entries are dropped once the database grows past this size
+MAX_DATABASE_BYTES = 100 * 1024 * 1024
+# Fraction of entries dropped each time the limit is hit
+PRUNE_FRACTION = 0.1
+
+MAX_QUERY_LIMIT = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS executions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    code_hash TEXT NOT NULL,
+    code TEXT NOT NULL,
+    status TEXT NOT NULL,
+    execution_count INTEGER,
+    started_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    output TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS executions_by_time ON executions (started_at);
+CREATE INDEX IF NOT EXISTS executions_by_session ON executions (session, started_at);
+CREATE INDEX IF NOT EXISTS executions_by_code ON executions (code_hash, started_at);
+'''
+
+COLUMNS = ('id', 'session', 'code_hash', 'code', 'status', 'execution_count', 'started_at', 'duration', 'output')
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode('utf-8')).hexdigest()
+
+
+def summarize_output(result):
+    """Text of an execute() result's output and error, truncated."""
+    text = ''.join(item.get('text', '') for item in result.get('output', []))
+    error = result.get('error')
+    if isinstance(error, dict):
+        text += f"{error.get('ename', 'Error')}: {error.get('evalue', '')}"
+    if len(text) > MAX_OUTPUT_CHARS:
+        text = text[:MAX_OUTPUT_CHARS] + f'... [{len(text) - MAX_OUTPUT_CHARS} more characters]'
+    return text
+
+
+class ExecutionHistory:
+    """
+    Append-only log of executions in SQLite, written by a background thread.
+    """
+
+    def __init__(self, path, max_bytes=MAX_DATABASE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Create the database if needed and start the writer thread."""
+        connection = self._connect()
+        try:
+            # Must be set before the first table is created to take effect
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.executescript(SCHEMA)
+            connection.commit()
+        finally:
+            connection.close()
+
+        self._thread = threading.Thread(target=self._write_loop, name='execution-history', daemon=True)
+        self._thread.start()
+
+    def close(self, timeout=5):
+        """Write whatever is queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def record_execution(self, execution):
+        """
+        Queue a finished execution for writing. Never blocks.
+
+        Args:
+            execution: kernel_manager.Execution
+        """
+        code = execution.code
+        result = execution.result
+        self._queue.put((
+            execution.kernel_id or '',
+            code_hash(code),
+            code,
+            result.get('status', 'unknown'),
+            result.get('execution_count'),
+            execution.started_at,
+            execution.duration,
+            summarize_output(result)
+        ))
+
+    def search(self, session=None, code_hash=None, text=None, since=None, until=None, limit=50, offset=0):
+        """
+        Find executions, newest first.
+
+        Args:
+            session: Kernel id
+            code_hash: sha256 of the code, as stored
+            text: Substring of the code
+            since: Earliest start time (Unix seconds)
+            until: Latest start time (Unix seconds)
+            limit: Maximum number of entries
+            offset: Entries to skip
+
+        Returns:
+            list of entry dicts
+        """
+        conditions = []
+        parameters = []
+        if session:
+            conditions.append('session = ?')
+            parameters.append(session)
+        if code_hash:
+            conditions.append('code_hash = ?')
+            parameters.append(code_hash)
+        if text:
+            conditions.append("code LIKE ? ESCAPE '\\'")
+            escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            parameters.append(f'%{escaped}%')
+        if since is not None:
+            conditions.append('started_at >= ?')
+            parameters.append(since)
+        if until is not None:
+            conditions.append('started_at <= ?')
+            parameters.append(until)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        query = (
+            f"SELECT {', '.join(COLUMNS)} FROM executions {where} "
+            'ORDER BY started_at DESC, id DESC LIMIT ? OFFSET ?'
+        )
+        parameters += [max(1, min(limit, MAX_QUERY_LIMIT)), max(0, offset)]
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(query, parameters).fetchall()
+        finally:
+            connection.close()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _write_loop(self):
+        connection = self._connect()
+        try:
+            while True:
+                batch = self._next_batch()
+                entries = [entry for entry in batch if entry is not None]
+                if entries:
+                    try:
+                        connection.executemany(
+                            'INSERT INTO executions (session, code_hash, code, status, execution_count, '
+                            'started_at, duration, output) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            entries
+                        )
+                        connection.commit()
+                        self._prune(connection)
+                    except sqlite3.Error as e:
+                        print(f'Execution history: could not write {len(entries)} entries: {e}')
+                if self._stopping.is_set() and self._queue.empty():
+                    return
+        finally:
+            connection.close()
+
+    def _next_batch(self):
+        """Wait for an entry, then collect more until the batch is full or due."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE and batch[-1] is not None:
+            # When stopping, take only what is already queued
+            remaining = 0 if self._stopping.is_set() else max(0, deadline - time.monotonic())
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _prune(self, connection):
+        """Drop the oldest entries, a slice at a time, until under max_bytes."""
+        while self._size(connection) > self.max_bytes:
+            total = connection.execute('SELECT COUNT(*) FROM executions').fetchone()[0]
+            if total == 0:
+                return
+            drop = max(1, int(total * PRUNE_FRACTION))
+            connection.execute(
+                'DELETE FROM executions WHERE id IN (SELECT id FROM executions ORDER BY id LIMIT ?)',
+                (drop,)
+            )
+            connection.commit()
+            connection.execute('PRAGMA incremental_vacuum')
+            connection.commit()
+
+    @staticmethod
+    def _size(connection):
+        page_count = connection.execute('PRAGMA page_count').fetchone()[0]
+        page_size = connection.execute('PRAGMA page_size').fetchone()[0]
+        return page_count * page_size
@@ -0,0 +1,115 @@
+"""
+Cached code completion and introspection for Accessible Notebooks.
+
+Completion and docstring lookups each cost a round trip to the kernel over
+the shell channel. This module keeps recent answers in a short-lived cache
+and lets identical concurrent requests share a single kernel round trip.
+"""
+
+import re
+import threading
+import time
+
+# Cached answers expire after this many seconds even if no cell has run,
+# since the user may have changed state in ways we cannot see (e.g. files).
+CACHE_TTL = 30.0
+MAX_CACHE_ENTRIES = 256
+
+IDENTIFIER_TAIL = re.compile(r'\w*')
+
+
+class _Pending:
+    """A kernel request in flight that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class IntrospectionCache:
+    """
+    Short-lived cache of completion and inspection replies for one kernel.
+
+    Entries are keyed by the kernel's id and generation plus the code up to
+    the cursor, so they are dropped automatically whenever a cell runs or
+    the kernel restarts.
+    """
+
+    def __init__(self, kernel, ttl=CACHE_TTL, max_entries=MAX_CACHE_ENTRIES):
+        self.kernel = kernel
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._generation = None
+
+    def complete(self, code, cursor_pos):
+        """
+        Completions at cursor_pos, from cache when possible.
+
+        Completions only depend on the text before the cursor, so that prefix
+        is the cache key.
+        """
+        key = ('complete', code[:cursor_pos])
+        return self._lookup(key, lambda: self.kernel.complete(code, cursor_pos))
+
+    def inspect(self, code, cursor_pos, detail_level=0):
+        """
+        Documentation for the name at cursor_pos, from cache when possible.
+
+        The kernel looks at the whole identifier under the cursor, so the
+        cache key extends the prefix to the end of that identifier.
+        """
+        end = IDENTIFIER_TAIL.match(code, cursor_pos).end()
+        key = ('inspect', code[:end], cursor_pos, detail_level)
+        return self._lookup(key, lambda: self.kernel.inspect(code, cursor_pos, detail_level))
+
+    def _lookup(self, key, fetch):
+        now = time.monotonic()
+
+        with self._lock:
+            generation = (self.kernel.kernel_id, self.kernel.generation)
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = _Pending()
+                self._pending[key] = pending
+
+        if not owner:
+            # Someone is already asking the kernel the same question
+            pending.done.wait()
+            return pending.result
+
+        try:
+            result = fetch()
+        except Exception as e:
+            result = {'status': 'error', 'message': str(e)}
+
+        with self._lock:
+            del self._pending[key]
+            # Only cache good answers that are still current
+            if result.get('status') == 'ok' and generation == (self.kernel.kernel_id, self.kernel.generation):
+                if len(self._entries) >= self.max_entries:
+                    self._evict(now)
+                self._entries[key] = (now + self.ttl, result)
+
+        pending.result = result
+        pending.done.set()
+        return result
+
+    def _evict(self, now):
+        expired = [key for key, (expires, _) in self._entries.items() if expires <= now]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            # Dicts keep insertion order, so the first entry is the oldest
+            del self._entries[next(iter(self._entries))]
@@ -3,40 +3,129 @@ Kernel Manager for Accessible Notebooks.
 Handles kernel lifecycle and code execution.
 """
 
+import queue
 import re
+import threading
+import time
+import uuid
 from jupyter_client import KernelManager
+from kernel_monitor import KernelMonitor, STOPPED, STARTING, IDLE, BUSY, RESTARTING, DEAD
 
 ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
 
+# Completion and inspection replies should be near-instant; if the kernel is
+# busy running a cell we give up rather than hold the request thread.
+SHELL_REQUEST_TIMEOUT = 5
+
+# Helper code run by evaluate() may walk the whole namespace
+EVALUATE_TIMEOUT = 15
+
+# An execution fails if the kernel goes this long without sending anything
+# (time spent waiting for the user to answer input() is not counted).
+IOPUB_TIMEOUT = 30
+IOPUB_POLL_INTERVAL = 0.1
+
+
+def _timestamp(msg):
+    date = msg['header'].get('date')
+    return date.isoformat() if hasattr(date, 'isoformat') else date
+
+
+class KernelDiedError(Exception):
+    pass
+
+
+class Execution:
+    """
+    One cell execution, kept around while it is paused waiting for input.
+    """
+
+    def __init__(self, msg_id, code, kernel_id, cell_id=None):
+        self.id = uuid.uuid4().hex
+        self.msg_id = msg_id
+        self.code = code
+        self.kernel_id = kernel_id
+        # Client's id for the cell that ran the code, if it sent one
+        self.cell_id = cell_id
+        # The input_request being waited on: {'prompt', 'password'}
+        self.input_request = None
+        self.started_at = time.time()
+        # Wall-clock seconds from sending the code to the kernel going idle
+        self.duration = None
+        self._started = time.monotonic()
+        self.result = {
+            'output': [],
+            'error': None,
+            'status': 'unknown',
+            # The same output in nbformat 4 form, for saving in the notebook
+            'outputs': [],
+            'execution_count': None,
+            # Message timestamps, as JupyterLab records them in cell metadata
+            'timing': {}
+        }
+
 
 class NotebookKernelManager:
     """
     Manages a single Jupyter kernel instance for the notebook session.
     """
 
-    def __init__(self):
+    def __init__(self, pool=None, registry=None):
         self.km = None
         self.client = None
+        # WarmKernelPool to take ready kernels from, if any
+        self.pool = pool
+        # KernelRegistry recording our kernel processes, if any
+        self.registry = registry
+        # Kernelspec of the running kernel
+        self.kernel_name = None
+        # Serializes readers of the shell channel
+        self._shell_lock = threading.Lock()
+        # Bumped whenever kernel state may have changed (execution, restart, ...)
+        # so anything cached about the kernel can tell it is stale.
+        self.generation = 0
+        # Execution paused on an input_request, if any
+        self.pending_input = None
+        # Cached kernel state; read this rather than calling is_alive()
+        self.monitor = KernelMonitor(self)
+        # Called with each finished Execution; must not block
+        self.execution_listeners = []
 
-    def start(self):
+    @property
+    def kernel_id(self):
+        return self.km.kernel_id if self.km is not None else None
+
+    def start(self, kernel_name=None):
         """
         Start the kernel and wait for it to be ready.
 
+        Args:
+            kernel_name: Kernelspec to start; the default kernelspec if None
+
         Returns:
-            dict with 'status' and 'kernel_id' keys
+            dict with 'status', 'kernel_id' and 'kernel_name' keys
         """
         if self.km is not None:
             return {'status': 'error', 'message': 'Kernel already running'}
 
+        self.monitor.set_state(STARTING)
         try:
-            self.km = KernelManager()
-            self.km.start_kernel()
-            self.client = self.km.client()
-            self.client.wait_for_ready(timeout=60)
+            self.km = self.pool.take(kernel_name or self._default_kernel_name()) if self.pool else None
+            if self.km is None:
+                self.km = KernelManager(kernel_name=kernel_name) if kernel_name else KernelManager()
+                self.km.start_kernel()
+            if self.registry is not None:
+                self.registry.register(self.km)
+            self.kernel_name = self.km.kernel_name
+            self._connect_client()
+            self.generation += 1
+            self.monitor.set_state(IDLE)
+            self.monitor.start()
 
             return {
                 'status': 'ok',
                 'kernel_id': self.km.kernel_id,
+                'kernel_name': self.kernel_name,
                 'message': 'Kernel started successfully'
             }
         except Exception as e:
@@ -45,19 +134,41 @@ class NotebookKernelManager:
                     self.km.shutdown_kernel(now=True)
                 except Exception:
                     pass
+                if self.registry is not None:
+                    self.registry.unregister(self.km)
             self.km = None
             self.client = None
+            self.kernel_name = None
+            self.monitor.set_state(STOPPED)
             return {
                 'status': 'error',
                 'message': f'Failed to start kernel: {str(e)}'
             }
 
-    def execute(self, code):
+    def _default_kernel_name(self):
+        return self.pool.specs.default_name
+
+    def _connect_client(self):
+        """Create a client for the current kernel, wait for it, and start its heartbeat."""
+        if self.client is not None:
+            self.client.stop_channels()
+        self.client = self.km.client()
+        self.client.wait_for_ready(timeout=60)
+        # wait_for_ready does not start the heartbeat channel
+        self.client.hb_channel.start()
+
+    def execute(self, code, cell_id=None):
         """
         Execute code in the kernel and return all output.
 
+        If the code asks for input (e.g. calls input()), execution pauses and
+        this returns early with status 'input_requested'; call send_input()
+        with the returned 'execution_id' to answer and carry on. The paused
+        prompt stays available from pending_input_request().
+
         Args:
             code: String of Python code to execute
+            cell_id: Client's id for the cell, returned with the paused prompt
 
         Returns:
             dict with 'output', 'error', and 'status' keys
@@ -69,80 +180,86 @@ class NotebookKernelManager:
                 'output': []
             }
 
+        if self.pending_input is not None:
+            return {
+                'status': 'error',
+                'error': {
+                    'ename': 'KernelBusy',
+                    'evalue': 'Kernel is waiting for input to a previous cell',
+                    'traceback': [],
+                    # Lets a client that lost the prompt answer or cancel it
+                    'pending_input': self.pending_input_request()
+                },
+                'output': []
+            }
+
         try:
             # Execute the code and get a message ID to track responses
-            msg_id = self.client.execute(code)
+            self.monitor.set_state(BUSY)
+            msg_id = self.client.execute(code, allow_stdin=True)
+            return self._collect_output(Execution(msg_id, code, self.kernel_id, cell_id))
 
-            result = {
-                'output': [],
-                'error': None,
-                'status': 'unknown'
+        except Exception as e:
+            return {
+                'status': 'error',
+                'error': {
+                    'ename': 'ExecutionError',
+                    'evalue': str(e),
+                    'traceback': [f"Failed to execute code: {e}"]
+                },
+                'output': []
             }
 
-            # Wait for messages from the kernel
-            # The kernel sends multiple messages for a single execution in this order:
-            # 1. status: execution_state='busy' (kernel started working)
-            # 2. execute_input: echoes what was sent
-            # 3. stream: stdout/stderr output (may have multiple)
-            # 4. execute_result: the result value (like in a REPL)
-            #    OR error: if an exception occurred
-            # 5. status: execution_state='idle' (THIS IS HOW WE KNOW IT'S DONE!)
-            # 6. execute_reply: final status on shell channel
-            #
-            # We listen until we get the 'idle' status message
-
-            while True:
-                try:
-                    # Check the IOPub channel for output messages
-                    msg = self.client.get_iopub_msg(timeout=30)
-                    msg_type = msg['header']['msg_type']
-                    content = msg['content']
-
-                    # Only process messages related to our execution
-                    if 'parent_header' in msg and msg['parent_header'].get('msg_id') == msg_id:
-
-                        if msg_type == 'stream':
-                            # Standard output/error
-                            result['output'].append({
-                                'type': 'stream',
-                                'name': content.get('name', 'stdout'),
-                                'text': content['text']
-                            })
-
-                        elif msg_type == 'execute_result':
-                            # The actual result value (what would be printed in REPL)
-                            result['output'].append({
-                                'type': 'execute_result',
-                                'text': content['data'].get('text/plain', '')
-                            })
-
-                        elif msg_type == 'error':
-                            # An error occurred
-                            raw_tb = content.get('traceback', [])
-                            clean_tb = [ANSI_ESCAPE.sub('', line) for line in raw_tb]
-                            result['error'] = {
-                                'ename': content.get('ename', 'Error'),
-                                'evalue': content.get('evalue', ''),
-                                'traceback': clean_tb
-                            }
-                            result['status'] = 'error'
-
-                        elif msg_type == 'status' and content['execution_state'] == 'idle':
-                            # Kernel finished executing
-                            if result['status'] == 'unknown':
-                                result['status'] = 'ok'
-                            break
-
-                except Exception as e:
-                    result['error'] = {
-                        'ename': 'Timeout',
-                        'evalue': str(e),
-                        'traceback': [f"Timeout or error waiting for kernel: {e}"]
-                    }
-                    result['status'] = 'error'
-                    break
-
-            return result
+    def pending_input_request(self):
+        """
+        The prompt an execution is paused on, for clients that missed it.
+
+        Returns:
+            dict like an 'input_requested' reply plus 'cell_id', or None
+        """
+        execution = self.pending_input
+        if execution is None or execution.input_request is None:
+            return None
+        return {
+            'execution_id': execution.id,
+            'cell_id': execution.cell_id,
+            'prompt': execution.input_request['prompt'],
+            'password': execution.input_request['password'],
+            'output': execution.result['output']
+        }
+
+    def send_input(self, execution_id, value=None, cancel=False):
+        """
+        Answer the input request of a paused execution and resume it.
+
+        Args:
+            execution_id: The 'execution_id' returned with 'input_requested'
+            value: The text to send to the kernel
+            cancel: Interrupt the kernel instead of answering
+
+        Returns:
+            Same as execute(): the final result, or another 'input_requested'
+        """
+        execution = self.pending_input
+        if execution is None or execution.id != execution_id:
+            return {
+                'status': 'error',
+                'error': {
+                    'ename': 'NoPendingInput',
+                    'evalue': 'No execution is waiting for this input',
+                    'traceback': []
+                },
+                'output': []
+            }
+
+        self.pending_input = None
+        try:
+            if cancel:
+                # input() raises KeyboardInterrupt, ending the cell normally
+                self.km.interrupt_kernel()
+            else:
+                self.client.input(value if value is not None else '')
+            return self._collect_output(execution)
 
         except Exception as e:
             return {
@@ -150,14 +267,294 @@ class NotebookKernelManager:
                 'error': {
                     'ename': 'ExecutionError',
                     'evalue': str(e),
-                    'traceback': [f"Failed to execute code: {e}"]
+                    'traceback': [f"Failed to send input: {e}"]
                 },
-                'output': []
+                'output': execution.result['output']
             }
 
+    def _collect_output(self, execution):
+        """
+        Gather output for an execution until it finishes or asks for input.
+
+        Time spent paused for input does not count towards the timeout; only
+        silence from the kernel while it is running does.
+        """
+        result = execution.result
+
+        # Wait for messages from the kernel
+        # The kernel sends multiple messages for a single execution in this order:
+        # 1. status: execution_state='busy' (kernel started working)
+        # 2. execute_input: echoes what was sent
+        # 3. stream: stdout/stderr output (may have multiple)
+        #    input_request on the stdin channel if the code calls input()
+        # 4. execute_result: the result value (like in a REPL)
+        #    OR error: if an exception occurred
+        # 5. status: execution_state='idle' (THIS IS HOW WE KNOW IT'S DONE!)
+        # 6. execute_reply: final status on shell channel
+        #
+        # We listen until we get the 'idle' status message
+
+        last_activity = time.monotonic()
+
+        while True:
+            try:
+                # The kernel blocks on input() until we answer, so check for
+                # that between short waits on IOPub.
+                if self.client.stdin_channel.msg_ready():
+                    msg = self.client.get_stdin_msg(timeout=0)
+                    if (msg['header']['msg_type'] == 'input_request'
+                            and msg['parent_header'].get('msg_id') == execution.msg_id):
+                        execution.input_request = {
+                            'prompt': msg['content'].get('prompt', ''),
+                            'password': msg['content'].get('password', False)
+                        }
+                        self.pending_input = execution
+                        return dict(self.pending_input_request(), status='input_requested')
+
+                try:
+                    # Check the IOPub channel for output messages
+                    msg = self.client.get_iopub_msg(timeout=IOPUB_POLL_INTERVAL)
+                except queue.Empty:
+                    if self.monitor.state == DEAD:
+                        raise KernelDiedError('The kernel died while running this cell')
+                    if time.monotonic() - last_activity > IOPUB_TIMEOUT:
+                        raise TimeoutError(f'No reply from kernel in {IOPUB_TIMEOUT} seconds')
+                    continue
+
+                last_activity = time.monotonic()
+                msg_type = msg['header']['msg_type']
+                content = msg['content']
+
+                # Only process messages related to our execution
+                if 'parent_header' in msg and msg['parent_header'].get('msg_id') == execution.msg_id:
+                    outputs = result['outputs']
+
+                    if msg_type == 'stream':
+                        # Standard output/error
+                        result['output'].append({
+                            'type': 'stream',
+                            'name': content.get('name', 'stdout'),
+                            'text': content['text']
+                        })
+                        name = content.get('name', 'stdout')
+                        if outputs and outputs[-1]['output_type'] == 'stream' and outputs[-1]['name'] == name:
+                            outputs[-1]['text'] += content['text']
+                        else:
+                            outputs.append({'output_type': 'stream', 'name': name, 'text': content['text']})
+
+                    elif msg_type == 'execute_result':
+                        # The actual result value (what would be printed in REPL)
+                        result['output'].append({
+                            'type': 'execute_result',
+                            'text': content['data'].get('text/plain', '')
+                        })
+                        outputs.append({
+                            'output_type': 'execute_result',
+                            'execution_count': content.get('execution_count'),
+                            'data': content['data'],
+                            'metadata': content.get('metadata', {})
+                        })
+
+                    elif msg_type == 'display_data':
+                        # Rich output (plots, tables, ...); only saved, not shown as text
+                        outputs.append({
+                            'output_type': 'display_data',
+                            'data': content['data'],
+                            'metadata': content.get('metadata', {})
+                        })
+
+                    elif msg_type == 'clear_output':
+                        outputs.clear()
+
+                    elif msg_type == 'execute_input':
+                        result['execution_count'] = content.get('execution_count')
+                        result['timing']['iopub.execute_input'] = _timestamp(msg)
+
+                    elif msg_type == 'error':
+                        # An error occurred
+                        raw_tb = content.get('traceback', [])
+                        clean_tb = [ANSI_ESCAPE.sub('', line) for line in raw_tb]
+                        result['error'] = {
+                            'ename': content.get('ename', 'Error'),
+                            'evalue': content.get('evalue', ''),
+                            'traceback': clean_tb
+                        }
+                        result['status'] = 'error'
+                        outputs.append(dict(result['error'], output_type='error'))
+
+                    elif msg_type == 'status' and content['execution_state'] == 'busy':
+                        result['timing']['iopub.status.busy'] = _timestamp(msg)
+
+                    elif msg_type == 'status' and content['execution_state'] == 'idle':
+                        # Kernel finished executing
+                        result['timing']['iopub.status.idle'] = _timestamp(msg)
+                        if result['status'] == 'unknown':
+                            result['status'] = 'ok'
+                        break
+
+            except Exception as e:
+                result['error'] = {
+                    'ename': 'KernelDied' if isinstance(e, KernelDiedError) else 'Timeout',
+                    'evalue': str(e),
+                    'traceback': [f"Timeout or error waiting for kernel: {e}"]
+                }
+                result['status'] = 'error'
+                break
+
+        self.generation += 1
+        if self.monitor.state == BUSY:
+            self.monitor.set_state(IDLE)
+
+        execution.duration = time.monotonic() - execution._started
+        for listener in self.execution_listeners:
+            try:
+                listener(execution)
+            except Exception as e:
+                print(f'Execution listener failed: {e}')
+
+        return result
+
+    def complete(self, code, cursor_pos):
+        """
+        Ask the kernel for completions at a cursor position.
+
+        Args:
+            code: The cell's code
+            cursor_pos: Cursor offset into code
+
+        Returns:
+            dict with 'status', 'matches', 'cursor_start' and 'cursor_end' keys
+        """
+        reply = self._shell_request(lambda: self.client.complete(code, cursor_pos))
+        if reply['status'] != 'ok':
+            return reply
+
+        return {
+            'status': 'ok',
+            'matches': reply['content'].get('matches', []),
+            'cursor_start': reply['content'].get('cursor_start', cursor_pos),
+            'cursor_end': reply['content'].get('cursor_end', cursor_pos)
+        }
+
+    def inspect(self, code, cursor_pos, detail_level=0):
+        """
+        Ask the kernel for documentation of the object at a cursor position.
+
+        Args:
+            code: The cell's code
+            cursor_pos: Cursor offset into code
+            detail_level: 0 for the docstring, 1 to include source
+
+        Returns:
+            dict with 'status', 'found' and 'text' keys
+        """
+        reply = self._shell_request(lambda: self.client.inspect(code, cursor_pos, detail_level))
+        if reply['status'] != 'ok':
+            return reply
+
+        content = reply['content']
+        return {
+            'status': 'ok',
+            'found': content.get('found', False),
+            'text': ANSI_ESCAPE.sub('', content.get('data', {}).get('text/plain', ''))
+        }
+
+    def evaluate(self, code, expression, timeout=EVALUATE_TIMEOUT):
+        """
+        Run code silently and return the value of an expression.
+
+        Nothing is added to the history, the execution count does not change
+        and no output is broadcast; the value comes back in the execute reply
+        as a mimebundle.
+
+        Args:
+            code: Setup code to run first (may be empty)
+            expression: Expression evaluated after code has run
+            timeout: Seconds to wait for the reply
+
+        Returns:
+            dict with 'status' and, on success, the expression's 'data' mimebundle
+        """
+        reply = self._shell_request(
+            lambda: self.client.execute(
+                code,
+                silent=True,
+                store_history=False,
+                user_expressions={'value': expression}
+            ),
+            timeout=timeout
+        )
+        if reply['status'] != 'ok':
+            return reply
+
+        content = reply['content']
+        if content.get('status') != 'ok':
+            return {
+                'status': 'error',
+                'message': f"{content.get('ename', 'Error')}: {content.get('evalue', '')}"
+            }
+
+        value = content.get('user_expressions', {}).get('value', {})
+        if value.get('status') != 'ok':
+            return {
+                'status': 'error',
+                'message': f"{value.get('ename', 'Error')}: {value.get('evalue', '')}"
+            }
+
+        return {'status': 'ok', 'data': value.get('data', {})}
+
+    def _shell_request(self, send, timeout=SHELL_REQUEST_TIMEOUT):
+        """
+        Send a request on the shell channel and wait for its reply.
+
+        execute() never reads the shell channel, so execute_reply messages
+        from earlier cells may be queued ahead of ours; they are discarded.
+
+        Args:
+            send: Callable that sends the request and returns its msg_id
+            timeout: Seconds to wait for the reply
+
+        Returns:
+            dict with 'status' and, on success, the reply 'content'
+        """
+        if self.km is None or self.client is None:
+            return {'status': 'error', 'message': 'Kernel not started'}
+
+        with self._shell_lock:
+            try:
+                msg_id = send()
+                deadline = time.monotonic() + timeout
+
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    msg = self.client.get_shell_msg(timeout=remaining)
+                    if msg['parent_header'].get('msg_id') == msg_id:
+                        return {'status': 'ok', 'content': msg['content']}
+
+            except queue.Empty:
+                return {'status': 'error', 'message': 'Timed out waiting for kernel reply'}
+            except Exception as e:
+                return {'status': 'error', 'message': f'Kernel request failed: {str(e)}'}
+
+    def is_beating(self):
+        """
+        Check whether the kernel answered its most recent heartbeat.
+
+        Returns:
+            bool: True if the heartbeat channel reports a beating kernel
+        """
+        if self.client is None:
+            return False
+        return self.client.hb_channel.is_beating()
+
     def is_alive(self):
         """
-        Check if the kernel is alive.
+        Check if the kernel process is alive.
+
+        This asks the process directly; request handlers should use the
+        cached monitor.alive instead.
 
         Returns:
             bool: True if kernel is alive, False otherwise
@@ -166,34 +563,53 @@ class NotebookKernelManager:
             return False
         return self.km.is_alive()
 
-    def restart(self):
+    def restart(self, kernel_name=None):
         """
         Restart the kernel.
 
+        Args:
+            kernel_name: Switch to this kernelspec instead of restarting the
+                current one, if it differs
+
         Returns:
             dict with 'status' and 'message' keys
         """
+        if kernel_name and self.km is not None and kernel_name != self.kernel_name:
+            self.shutdown()
+            return self.start(kernel_name)
+
+        self.pending_input = None
         try:
             if self.km is not None:
+                self.monitor.set_state(RESTARTING)
                 self.km.restart_kernel()
-                self.client = self.km.client()
-                self.client.wait_for_ready(timeout=60)
+                # The kernel process was replaced
+                if self.registry is not None:
+                    self.registry.register(self.km)
+                self._connect_client()
+                self.generation += 1
+                self.monitor.set_state(IDLE)
                 return {
                     'status': 'ok',
+                    'kernel_name': self.kernel_name,
                     'message': 'Kernel restarted successfully'
                 }
             else:
-                return self.start()
+                return self.start(kernel_name)
         except Exception as e:
+            self.monitor.set_state(DEAD)
             return {
                 'status': 'error',
                 'message': f'Failed to restart kernel: {str(e)}'
             }
 
-    def shutdown(self):
+    def shutdown(self, now=False):
         """
         Shutdown the kernel.
 
+        Args:
+            now: Kill the kernel process instead of asking it to exit
+
         Returns:
             dict with 'status' and 'message' keys
         """
@@ -203,10 +619,17 @@ class NotebookKernelManager:
                 'message': 'Kernel not running'
             }
 
+        self.pending_input = None
         try:
-            self.km.shutdown_kernel()
+            self.client.stop_channels()
+            self.km.shutdown_kernel(now=now)
+            if self.registry is not None:
+                self.registry.unregister(self.km)
             self.km = None
             self.client = None
+            self.kernel_name = None
+            self.generation += 1
+            self.monitor.set_state(STOPPED)
             return {
                 'status': 'ok',
                 'message': 'Kernel shutdown successfully'
@@ -0,0 +1,166 @@
+"""
+Kernel liveness monitor for Accessible Notebooks.
+
+One background thread watches the kernel's process and heartbeat and keeps
+the result in memory, so status requests never have to touch the kernel.
+Clients can wait for the next state change instead of polling.
+"""
+
+import threading
+import time
+
+# Seconds between liveness checks
+HEARTBEAT_INTERVAL = 1.0
+
+# Consecutive missed heartbeats before a kernel whose process is still
+# running is considered dead (a busy kernel can miss the odd beat).
+MISSED_BEATS_BEFORE_DEAD = 3
+
+# Kernel states
+STOPPED = 'stopped'
+STARTING = 'starting'
+IDLE = 'idle'
+BUSY = 'busy'
+RESTARTING = 'restarting'
+DEAD = 'dead'
+
+LIVE_STATES = {IDLE, BUSY}
+
+# States a start or restart passes through on its way to a live state
+TRANSITIONAL_STATES = {STARTING, RESTARTING}
+
+
+class KernelMonitor:
+    """
+    Cached kernel state, kept current by a heartbeat thread.
+
+    NotebookKernelManager reports the transitions it causes (starting,
+    busy, idle, ...); the thread only adds the one nobody reports: death.
+    """
+
+    def __init__(self, kernel, interval=HEARTBEAT_INTERVAL):
+        self.kernel = kernel
+        self.interval = interval
+        self.state = STOPPED
+        self.changed_at = time.time()
+        # Incremented on every change so waiters can tell what they have seen
+        self.version = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stop = threading.Event()
+        self._missed_beats = 0
+        # State to go back to if a kernel we thought dead starts beating again
+        self._last_live_state = IDLE
+
+    @property
+    def alive(self):
+        return self.state in LIVE_STATES
+
+    def start(self):
+        """Start the heartbeat thread, if it is not already running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='kernel-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def set_state(self, state):
+        """Record a new state and wake anyone waiting for a change."""
+        with self._condition:
+            if state == self.state:
+                return
+            self.state = state
+            self.changed_at = time.time()
+            self.version += 1
+            if state in LIVE_STATES:
+                self._last_live_state = state
+            self._missed_beats = 0
+            self._condition.notify_all()
+
+    def snapshot(self):
+        """
+        Current state, without contacting the kernel.
+
+        Returns:
+            dict with 'state', 'alive', 'changed_at' and 'version' keys
+        """
+        with self._condition:
+            return {
+                'state': self.state,
+                'alive': self.state in LIVE_STATES,
+                'changed_at': self.changed_at,
+                'version': self.version
+            }
+
+    def wait_for_change(self, seen_version=None, timeout=None):
+        """
+        Block until the state differs from the version the caller has seen.
+
+        Args:
+            seen_version: Last 'version' the caller received, or None to get
+                the current state immediately
+            timeout: Seconds to wait
+
+        Returns:
+            A snapshot, or None if nothing changed before the timeout
+        """
+        with self._condition:
+            if seen_version is None or self.version != seen_version:
+                return self.snapshot()
+            self._condition.wait(timeout)
+            if self.version != seen_version:
+                return self.snapshot()
+            return None
+
+    def wait_until_settled(self, timeout):
+        """
+        Block while a start or restart is in progress.
+
+        Returns:
+            True if the kernel is live afterwards
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.state in TRANSITIONAL_STATES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self.state in LIVE_STATES
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            state = self.state
+            if state not in LIVE_STATES and state != DEAD:
+                # Stopped, or a start/restart is in progress
+                continue
+
+            try:
+                process_alive = self.kernel.is_alive()
+                beating = self.kernel.is_beating()
+            except Exception:
+                process_alive, beating = False, False
+
+            with self._condition:
+                if self.state != state:
+                    # Someone else changed the state while we were checking
+                    continue
+                if not process_alive:
+                    self._missed_beats = 0
+                    dead = True
+                elif beating:
+                    self._missed_beats = 0
+                    dead = False
+                else:
+                    self._missed_beats += 1
+                    dead = self._missed_beats >= MISSED_BEATS_BEFORE_DEAD or state == DEAD
+
+            if dead and state != DEAD:
+                self.set_state(DEAD)
+            elif not dead and state == DEAD:
+                self.set_state(self._last_live_state)
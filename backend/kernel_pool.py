@@ -0,0 +1,217 @@
+"""
+Kernelspec discovery and warm kernel pools for Accessible Notebooks.
+
+Finding installed kernelspecs means walking several directories and reading
+every kernel.json, so the result is cached and only rebuilt when one of
+those directories changes. Starting a kernel takes seconds; for the
+kernelspecs used most, a kernel is started ahead of time so switching
+notebooks (or restarting) does not wait for a cold start.
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from jupyter_client import KernelManager
+from jupyter_client.kernelspec import KernelSpecManager
+
+# Seconds between checks of the kernelspec directories for changes
+SPEC_CHECK_INTERVAL = 2.0
+
+# Ready kernels kept per warm kernelspec
+POOL_SIZE = 1
+
+# How many of the most-used kernelspecs are kept warm
+MAX_WARM_SPECS = 2
+
+KERNEL_READY_TIMEOUT = 60
+
+
+class KernelSpecCache:
+    """
+    Installed kernelspecs, rediscovered only when their directories change.
+    """
+
+    def __init__(self):
+        self.ksm = KernelSpecManager()
+        self._specs = None
+        self._signature = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get_all(self):
+        """
+        Returns:
+            dict mapping kernelspec name to {'display_name', 'language'}
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._specs is None or now - self._checked_at >= SPEC_CHECK_INTERVAL:
+                self._checked_at = now
+                signature = self._directory_signature()
+                if signature != self._signature:
+                    self._specs = self._discover()
+                    self._signature = signature
+            return self._specs
+
+    def exists(self, name):
+        return name in self.get_all()
+
+    @property
+    def default_name(self):
+        return KernelManager().kernel_name
+
+    def _discover(self):
+        specs = {}
+        for name, info in self.ksm.get_all_specs().items():
+            spec = info.get('spec', {})
+            specs[name] = {
+                'display_name': spec.get('display_name', name),
+                'language': spec.get('language', '')
+            }
+        return specs
+
+    def _directory_signature(self):
+        """Modification times of the kernelspec directories and their kernel.json files."""
+        signature = []
+        for directory in self.ksm.kernel_dirs:
+            try:
+                signature.append((directory, os.stat(directory).st_mtime_ns))
+                for entry in os.scandir(directory):
+                    kernel_json = os.path.join(entry.path, 'kernel.json')
+                    if entry.is_dir() and os.path.exists(kernel_json):
+                        signature.append((kernel_json, os.stat(kernel_json).st_mtime_ns))
+            except OSError:
+                signature.append((directory, None))
+        return tuple(signature)
+
+
+class WarmKernelPool:
+    """
+    Kernels started ahead of time for the most-used kernelspecs.
+
+    take() hands out a ready kernel when one is available; a background
+    thread then starts a replacement.
+    """
+
+    def __init__(self, specs, pool_size=POOL_SIZE, max_warm_specs=MAX_WARM_SPECS):
+        self.specs = specs
+        self.pool_size = pool_size
+        self.max_warm_specs = max_warm_specs
+        self._ready = {}
+        self._uses = Counter()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        # Called with each KernelManager the pool starts, and with each one
+        # it shuts down, so they can be tracked elsewhere
+        self.on_start = None
+        self.on_shutdown = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._refill_loop, name='kernel-pool', daemon=True)
+        self._thread.start()
+
+    def take(self, name):
+        """
+        Record a use of a kernelspec and hand out a ready kernel for it.
+
+        Returns:
+            A started KernelManager, or None if none is ready
+        """
+        with self._lock:
+            self._uses[name] += 1
+            ready = self._ready.get(name)
+            km = ready.pop(0) if ready else None
+        self._wake.set()
+
+        if km is not None and not km.is_alive():
+            self._shutdown(km)
+            return None
+        return km
+
+    def shutdown(self):
+        """Stop refilling and shut down every waiting kernel, in parallel."""
+        self._stopping.set()
+        self._wake.set()
+        with self._lock:
+            waiting = [km for ready in self._ready.values() for km in ready]
+            self._ready.clear()
+        if waiting:
+            try:
+                with ThreadPoolExecutor(max_workers=len(waiting)) as pool:
+                    list(pool.map(self._shutdown, waiting))
+            except RuntimeError:
+                # Called from atexit: no threads can be scheduled any more
+                for km in waiting:
+                    self._shutdown(km)
+        # A kernel still being started is shut down by the refill thread
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _warm_specs(self):
+        with self._lock:
+            names = [name for name, _ in self._uses.most_common(self.max_warm_specs)]
+        return [name for name in names if self.specs.exists(name)]
+
+    def _refill_loop(self):
+        while not self._stopping.is_set():
+            self._wake.wait()
+            self._wake.clear()
+
+            warm = self._warm_specs()
+
+            # Kernelspecs that dropped out of the top few give up their kernels
+            with self._lock:
+                cold = [name for name in self._ready if name not in warm]
+                retired = [km for name in cold for km in self._ready.pop(name)]
+            for km in retired:
+                self._shutdown(km)
+
+            for name in warm:
+                while not self._stopping.is_set():
+                    with self._lock:
+                        if len(self._ready.get(name, [])) >= self.pool_size:
+                            break
+                    km = self._start_kernel(name)
+                    if km is None:
+                        break
+                    with self._lock:
+                        if self._stopping.is_set():
+                            stale = km
+                        else:
+                            self._ready.setdefault(name, []).append(km)
+                            stale = None
+                    if stale is not None:
+                        self._shutdown(stale)
+
+    def _start_kernel(self, name):
+        km = KernelManager(kernel_name=name)
+        try:
+            km.start_kernel()
+            if self.on_start is not None:
+                self.on_start(km)
+            client = km.client()
+            client.start_channels()
+            try:
+                client.wait_for_ready(timeout=KERNEL_READY_TIMEOUT)
+            finally:
+                client.stop_channels()
+            return km
+        except Exception as e:
+            print(f'Kernel pool: could not start {name}: {e}')
+            self._shutdown(km)
+            return None
+
+    def _shutdown(self, km):
+        try:
+            km.shutdown_kernel(now=True)
+        except Exception:
+            pass
+        if self.on_shutdown is not None:
+            self.on_shutdown(km)
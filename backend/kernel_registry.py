@@ -0,0 +1,144 @@
+"""
+Registry of the kernels this server has started, for Accessible Notebooks.
+
+Every kernel process is recorded in a small JSON file together with the
+PID of the server that owns it and its connection file. If the server is
+killed or crashes, its kernels live on; the next server to start finds
+them in the registry and shuts them down, so they never pile up.
+"""
+
+import json
+import os
+import signal
+import threading
+import time
+
+# Seconds an orphaned kernel gets to exit after SIGTERM before SIGKILL
+TERMINATE_GRACE = 3.0
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to someone else
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def _is_kernel_process(pid, connection_file):
+    """
+    Guard against PID reuse: where the command line can be read, the
+    process must have been started with our connection file.
+    """
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            cmdline = f.read().decode('utf-8', 'replace')
+    except OSError:
+        return True
+    return os.path.basename(connection_file) in cmdline
+
+
+def _terminate(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError:
+        return
+
+    deadline = time.monotonic() + TERMINATE_GRACE
+    while time.monotonic() < deadline:
+        if not _process_exists(pid):
+            return
+        time.sleep(0.1)
+
+    # SIGKILL does not exist on Windows, where SIGTERM already kills
+    try:
+        os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    except OSError:
+        pass
+
+
+class KernelRegistry:
+    """
+    Kernel processes started by servers using this notebooks directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.server_pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def register(self, km):
+        """Record a started KernelManager's process (again, after a restart)."""
+        pid = getattr(km.provisioner, 'pid', None) if km.provisioner is not None else None
+        with self._lock:
+            entries = self._load()
+            entries[km.kernel_id] = {
+                'server_pid': self.server_pid,
+                'pid': pid,
+                'connection_file': km.connection_file,
+                'kernel_name': km.kernel_name,
+                'started_at': time.time()
+            }
+            self._save(entries)
+
+    def unregister(self, km):
+        with self._lock:
+            entries = self._load()
+            if entries.pop(km.kernel_id, None) is not None:
+                self._save(entries)
+
+    def reap_orphans(self):
+        """
+        Shut down kernels whose server is no longer running.
+
+        Kernels of servers that are still running are left alone, and
+        registry entries whose kernel has already exited are just removed.
+
+        Returns:
+            Number of kernel processes that were terminated
+        """
+        with self._lock:
+            entries = self._load()
+            orphans = {
+                kernel_id: entry for kernel_id, entry in entries.items()
+                if entry.get('server_pid') != self.server_pid
+                and not _process_exists(entry.get('server_pid') or 0)
+            }
+            for kernel_id in orphans:
+                del entries[kernel_id]
+            self._save(entries)
+
+        reaped = 0
+        for entry in orphans.values():
+            pid = entry.get('pid')
+            connection_file = entry.get('connection_file') or ''
+            if pid and _process_exists(pid) and _is_kernel_process(pid, connection_file):
+                _terminate(pid)
+                reaped += 1
+            if connection_file:
+                try:
+                    os.remove(connection_file)
+                except OSError:
+                    pass
+
+        return reaped
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(temp_path, self.path)
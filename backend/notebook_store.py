@@ -0,0 +1,425 @@
+"""
+Notebook storage for Accessible Notebooks.
+
+Uploaded notebooks are parsed incrementally, one cell at a time, straight
+from the request body, so memory use is bounded by the largest single cell
+rather than the whole file. Each stored notebook gets a small index of its
+cells with their byte ranges in the file, so clients can page through a
+huge notebook without it ever being loaded as one document.
+
+Uploads are hashed as they are read. Importing a file already stored with
+the same outputs mode reuses the stored notebook rather than adding a copy.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import ijson
+from werkzeug.utils import secure_filename
+
+from output_store import compact_output
+
+CELL_TYPES = {'code', 'markdown', 'raw'}
+
+# Characters of source shown for each cell in the index
+PREVIEW_CHARS = 80
+
+# What to do with outputs on import
+KEEP_OUTPUTS = 'keep'
+EXTERNALIZE_OUTPUTS = 'externalize'
+STRIP_OUTPUTS = 'strip'
+OUTPUT_MODES = {KEEP_OUTPUTS, EXTERNALIZE_OUTPUTS, STRIP_OUTPUTS}
+
+# Bytes read at a time when finishing the hash of an upload
+HASH_CHUNK = 64 * 1024
+
+
+class NotebookFormatError(ValueError):
+    pass
+
+
+def notebook_filename(name):
+    """
+    A safe file name for a notebook, always ending in .ipynb.
+
+    Returns:
+        The file name, or None if nothing usable is left of name
+    """
+    filename = secure_filename(name or '')
+    if not filename:
+        return None
+    if not filename.endswith('.ipynb'):
+        filename += '.ipynb'
+    return filename
+
+
+def validate_cell(cell, index):
+    """Check the parts of the nbformat 4 cell schema we rely on."""
+    if not isinstance(cell, dict):
+        raise NotebookFormatError(f'Cell {index} is not an object')
+
+    cell_type = cell.get('cell_type')
+    if cell_type not in CELL_TYPES:
+        raise NotebookFormatError(f'Cell {index} has invalid cell_type {cell_type!r}')
+
+    source = cell.get('source', '')
+    if not (isinstance(source, str) or (isinstance(source, list) and all(isinstance(s, str) for s in source))):
+        raise NotebookFormatError(f'Cell {index} has invalid source')
+
+    if not isinstance(cell.get('metadata', {}), dict):
+        raise NotebookFormatError(f'Cell {index} has invalid metadata')
+
+    if cell_type == 'code':
+        if not isinstance(cell.get('outputs', []), list):
+            raise NotebookFormatError(f'Cell {index} has invalid outputs')
+        execution_count = cell.get('execution_count')
+        if execution_count is not None and not isinstance(execution_count, int):
+            raise NotebookFormatError(f'Cell {index} has invalid execution_count')
+
+
+def summarize_cell(cell):
+    source = cell.get('source', '')
+    source = ''.join(source) if isinstance(source, list) else source
+    first_line = source.strip().split('\n', 1)[0]
+
+    summary = {
+        'cell_type': cell['cell_type'],
+        'preview': first_line[:PREVIEW_CHARS]
+    }
+    if cell['cell_type'] == 'code':
+        summary['execution_count'] = cell.get('execution_count')
+        summary['output_count'] = len(cell.get('outputs', []))
+    return summary
+
+
+class _ChunkReader:
+    """
+    File-like wrapper that hashes what is read and never passes a
+    zero-length read to the stream.
+
+    ijson probes its input with read(0), which werkzeug's request stream
+    takes as a client disconnect.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        if size == 0:
+            return b''
+        data = self.stream.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        """Hash of the whole stream, including anything the parser left unread."""
+        while self.read(HASH_CHUNK):
+            pass
+        return self.sha256.hexdigest()
+
+
+class NotebookStore:
+    """
+    Notebooks saved on the server, each with a cell index alongside.
+    """
+
+    def __init__(self, directory, blob_store):
+        self.directory = directory
+        self.index_directory = os.path.join(directory, '.index')
+        # Maps '<outputs mode>:<sha256 of the upload>' to the stored name
+        self.imports_path = os.path.join(self.index_directory, 'imports.json')
+        self.blob_store = blob_store
+        self._lock = threading.Lock()
+
+    def import_stream(self, name, stream, outputs=EXTERNALIZE_OUTPUTS):
+        """
+        Parse a notebook from a file-like object and store it.
+
+        Args:
+            name: File name to store the notebook under
+            stream: Binary file-like object with the notebook's JSON
+            outputs: 'keep', 'externalize' (large outputs to the blob cache)
+                or 'strip' (drop all outputs)
+
+        Returns:
+            The notebook's index summary (see get_index); for a file already
+            imported with the same outputs mode, that of the stored copy
+
+        Raises:
+            NotebookFormatError: The data is not an nbformat 4 notebook
+        """
+        filename = notebook_filename(name)
+        if filename is None:
+            raise NotebookFormatError('Invalid notebook name')
+        if outputs not in OUTPUT_MODES:
+            raise NotebookFormatError(f'Invalid outputs mode {outputs!r}')
+
+        os.makedirs(self.index_directory, exist_ok=True)
+        filename = self._reserve_filename(filename)
+        path = os.path.join(self.directory, filename)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        index_path = self._index_path(filename)
+        index_temp_path = f'{index_path}.{os.getpid()}.tmp'
+
+        reader = _ChunkReader(stream)
+
+        try:
+            with open(temp_path, 'wb') as f:
+                index = self._write_cells(f, reader, outputs)
+            index['name'] = filename
+            with open(index_temp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            key = f'{outputs}:{reader.hexdigest()}'
+
+            with self._lock:
+                imports = self._load_imports()
+                existing = self._load_index(imports[key]) if key in imports else None
+                if existing is not None:
+                    # Same file as before: drop this copy and its reserved name
+                    os.remove(path)
+                    return self._summary(existing)
+
+                # The name is new, so no reader has an index for it yet; the
+                # index appears only once the file it describes is in place
+                os.replace(temp_path, path)
+                os.replace(index_temp_path, index_path)
+                imports[key] = filename
+                self._save_imports(imports)
+        except BaseException:
+            # Give the reserved name back
+            if not os.path.exists(index_path) and os.path.exists(path):
+                os.remove(path)
+            raise
+        finally:
+            for leftover in (temp_path, index_temp_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+        return self._summary(index)
+
+    def _reserve_filename(self, filename):
+        """
+        Claim an unused name, adding -1, -2, ... to filename if taken.
+
+        Existing notebooks are never overwritten; the claimed name is held
+        by an empty placeholder file until the import replaces it.
+        """
+        stem = filename[:-len('.ipynb')]
+        candidate = filename
+        suffix = 0
+        while True:
+            path = os.path.join(self.directory, candidate)
+            if not os.path.exists(self._index_path(candidate)):
+                try:
+                    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    return candidate
+                except FileExistsError:
+                    pass
+            suffix += 1
+            candidate = f'{stem}-{suffix}.ipynb'
+
+    def _write_cells(self, f, stream, outputs):
+        """
+        Copy cells from the parser to f as they complete.
+
+        Returns:
+            The index: notebook metadata plus a summary and byte range per cell
+        """
+        top_level = {}
+        cells = []
+        builder = None
+        builder_prefix = None
+        # Outputs of the cell being read are built one at a time, outside
+        # the cell's builder, so they can be compacted (or dropped) as each
+        # one completes instead of the whole list being held in memory
+        cell_outputs = None
+        output_builder = None
+        skipping_output = False
+
+        f.write(b'{\n "cells": [')
+
+        try:
+            for prefix, event, value in ijson.parse(stream, use_float=True):
+                if builder_prefix == 'cells.item' and prefix.startswith('cells.item.outputs'):
+                    if prefix == 'cells.item.outputs':
+                        if event == 'start_array':
+                            cell_outputs = []
+                        elif event != 'end_array':
+                            raise NotebookFormatError(f'Cell {len(cells)} has invalid outputs')
+                    elif output_builder is not None:
+                        output_builder.event(event, value)
+                        if prefix == 'cells.item.outputs.item' and event == 'end_map':
+                            cell_outputs.append(self._compact_output(output_builder.value, outputs))
+                            output_builder = None
+                    elif skipping_output:
+                        # Stripped outputs are never built at all
+                        if prefix == 'cells.item.outputs.item' and event == 'end_map':
+                            skipping_output = False
+                    elif prefix == 'cells.item.outputs.item' and event == 'start_map':
+                        if outputs == STRIP_OUTPUTS:
+                            skipping_output = True
+                        else:
+                            output_builder = ijson.ObjectBuilder()
+                            output_builder.event(event, value)
+                    elif prefix == 'cells.item.outputs.item':
+                        raise NotebookFormatError(f'Cell {len(cells)} has an output that is not an object')
+                    continue
+
+                if builder is not None:
+                    builder.event(event, value)
+                    if prefix == builder_prefix and event == 'end_map':
+                        if builder_prefix == 'cells.item':
+                            cell = builder.value
+                            if cell_outputs is not None:
+                                cell['outputs'] = cell_outputs
+                                cell_outputs = None
+                            self._write_cell(f, cell, cells, outputs)
+                        else:
+                            top_level[builder_prefix] = builder.value
+                        builder = None
+                    continue
+
+                if prefix == '' and event not in ('start_map', 'end_map', 'map_key'):
+                    raise NotebookFormatError('Notebook is not a JSON object')
+                if prefix == 'cells' and event not in ('start_array', 'end_array'):
+                    raise NotebookFormatError('Notebook cells are not a list')
+
+                if prefix == 'cells.item' and event == 'start_map':
+                    builder, builder_prefix = ijson.ObjectBuilder(), prefix
+                    builder.event(event, value)
+                elif prefix == 'cells.item':
+                    raise NotebookFormatError(f'Cell {len(cells)} is not an object')
+                elif prefix == 'metadata' and event == 'start_map':
+                    builder, builder_prefix = ijson.ObjectBuilder(), prefix
+                    builder.event(event, value)
+                elif prefix in ('nbformat', 'nbformat_minor') and event == 'number':
+                    top_level[prefix] = value
+
+        except ijson.JSONError as e:
+            raise NotebookFormatError(f'Invalid JSON: {e}')
+
+        if top_level.get('nbformat') != 4:
+            raise NotebookFormatError('Only nbformat 4 notebooks are supported')
+
+        metadata = top_level.get('metadata', {})
+        if not isinstance(metadata, dict):
+            raise NotebookFormatError('Notebook metadata is not an object')
+
+        nbformat_minor = top_level.get('nbformat_minor', 0)
+        f.write(b'\n ],\n "metadata": ')
+        f.write(json.dumps(metadata).encode('utf-8'))
+        f.write(f',\n "nbformat": 4,\n "nbformat_minor": {int(nbformat_minor)}\n}}\n'.encode('utf-8'))
+
+        return {
+            'nbformat': 4,
+            'nbformat_minor': int(nbformat_minor),
+            'metadata': metadata,
+            'cells': cells
+        }
+
+    def _compact_output(self, output, outputs):
+        if outputs == EXTERNALIZE_OUTPUTS and isinstance(output, dict):
+            return compact_output(output, self.blob_store)
+        return output
+
+    def _write_cell(self, f, cell, cells, outputs):
+        validate_cell(cell, len(cells))
+
+        if cell['cell_type'] == 'code' and outputs == STRIP_OUTPUTS:
+            cell['outputs'] = []
+            cell['execution_count'] = None
+
+        data = json.dumps(cell).encode('utf-8')
+        f.write(b',\n  ' if cells else b'\n  ')
+        entry = summarize_cell(cell)
+        entry['offset'] = f.tell()
+        entry['length'] = len(data)
+        f.write(data)
+        cells.append(entry)
+
+    def get_index(self, name):
+        """
+        Summary of a stored notebook: metadata and one short entry per cell.
+
+        Returns:
+            dict, or None if there is no such notebook
+        """
+        index = self._load_index(name)
+        return self._summary(index) if index is not None else None
+
+    def get_cells(self, name, offset=0, limit=50):
+        """
+        Read a page of cells from a stored notebook.
+
+        Only the requested cells are read from disk.
+
+        Returns:
+            dict with 'total', 'offset' and 'cells' keys, or None if there is
+            no such notebook
+        """
+        index = self._load_index(name)
+        if index is None:
+            return None
+
+        offset = max(0, offset)
+        entries = index['cells'][offset:offset + max(0, limit)]
+        cells = []
+        with open(os.path.join(self.directory, index['name']), 'rb') as f:
+            for entry in entries:
+                f.seek(entry['offset'])
+                cells.append(json.loads(f.read(entry['length'])))
+
+        return {
+            'total': len(index['cells']),
+            'offset': offset,
+            'cells': cells
+        }
+
+    def _load_index(self, name):
+        filename = notebook_filename(name)
+        if filename is None:
+            return None
+        try:
+            with open(self._index_path(filename), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _load_imports(self):
+        try:
+            with open(self.imports_path, 'r', encoding='utf-8') as f:
+                imports = json.load(f)
+            return imports if isinstance(imports, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_imports(self, imports):
+        # Forget notebooks that have been deleted since
+        imports = {
+            key: name for key, name in imports.items()
+            if os.path.exists(self._index_path(name))
+        }
+        temp_path = f'{self.imports_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(imports, f)
+        os.replace(temp_path, self.imports_path)
+
+    def _index_path(self, filename):
+        return os.path.join(self.index_directory, filename + '.json')
+
+    @staticmethod
+    def _summary(index):
+        return {
+            'name': index['name'],
+            'nbformat': index['nbformat'],
+            'nbformat_minor': index['nbformat_minor'],
+            'metadata': index['metadata'],
+            'cell_count': len(index['cells']),
+            'cells': [
+                {key: value for key, value in entry.items() if key not in ('offset', 'length')}
+                for entry in index['cells']
+            ]
+        }
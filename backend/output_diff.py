@@ -0,0 +1,165 @@
+"""
+Output diffing for Accessible Notebooks.
+
+When a cell is run again its output is often nearly the same as last time.
+The server remembers the output text last sent for each cell, and a client
+that still shows it can ask for only the lines that changed. The client
+then patches those lines in place instead of replacing the whole output,
+so less is sent, less is redrawn, and a screen reader is not made to read
+unchanged output again.
+
+Outputs are compared as lists of lines (the text split on '\\n'). A diff is
+a list of [start, end, lines] operations in the old output's line numbers,
+each replacing old lines start..end-1 with the given lines, in ascending
+order; apply them from last to first so earlier line numbers stay valid.
+
+The cell's nbformat outputs, kept by the client for saving, are diffed too:
+each new output is compared with the previous output at the same position,
+and described by one entry of an outputs diff:
+
+    i                               previous output i, unchanged
+    {'index': i, 'set': {...},      previous output i with the fields in
+     'ops': [...]}                  'set' replaced and, for a stream, its
+                                    text patched by line operations
+    {'output': {...}}               a new output, whole
+"""
+
+import difflib
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Cells whose last output is remembered
+MAX_TRACKED_CELLS = 200
+
+# Outputs longer than this are always sent whole; comparing them would take
+# longer than sending them
+MAX_DIFF_CHARS = 2 * 1024 * 1024
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def display_text(result):
+    """
+    Output text of an execute() result, laid out as the frontend shows it.
+    """
+    text = ''.join(
+        item.get('text', '') for item in result.get('output', [])
+        if item.get('type') in ('stream', 'execute_result')
+    )
+
+    if result.get('status') == 'error':
+        error = result.get('error')
+        if isinstance(error, dict):
+            traceback = error.get('traceback') or []
+            error_text = '\n'.join(traceback) if traceback else f"{error.get('ename')}: {error.get('evalue')}"
+        else:
+            error_text = str(error)
+        return f'{text}\n{error_text}' if text else error_text
+
+    return text or '(No output)'
+
+
+def diff_lines(old, new):
+    """
+    Returns:
+        list of [start, end, lines] operations turning old into new
+    """
+    matcher = difflib.SequenceMatcher(None, old, new)
+    return [
+        [i1, i2, new[j1:j2]]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+def ops_size(ops):
+    return sum(len(line) + 1 for _, _, lines in ops for line in lines)
+
+
+def diff_output(index, old, new):
+    """
+    Returns:
+        outputs diff entry describing new relative to old, the previous
+        output at the same position (see module docstring)
+    """
+    if old == new:
+        return index
+    if (old.get('output_type') != new.get('output_type') or old.get('name') != new.get('name')
+            or set(old) - set(new)):
+        return {'output': new}
+
+    changed = {key: value for key, value in new.items() if old.get(key) != value}
+
+    entry = {'index': index}
+    old_text, new_text = old.get('text'), new.get('text')
+    if (new.get('output_type') == 'stream' and 'text' in changed
+            and isinstance(old_text, str) and isinstance(new_text, str)
+            and len(old_text) <= MAX_DIFF_CHARS and len(new_text) <= MAX_DIFF_CHARS):
+        ops = diff_lines(old_text.split('\n'), new_text.split('\n'))
+        if ops_size(ops) < len(new_text):
+            del changed['text']
+            entry['ops'] = ops
+    if changed:
+        entry['set'] = changed
+    return entry
+
+
+class OutputDiffer:
+    """
+    Last output text and nbformat outputs per cell, and diffs against them.
+    """
+
+    def __init__(self, max_cells=MAX_TRACKED_CELLS):
+        self.max_cells = max_cells
+        self._outputs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(self, cell_id, result, base=None):
+        """
+        Remember a cell's new output and describe it relative to base.
+
+        Args:
+            cell_id: The cell's id
+            result: A finished execute() result, its 'outputs' already
+                compacted the way the client keeps them
+            base: Hash of the output the client shows, from an earlier reply
+
+        Returns:
+            (diff, outputs_diff): diff is a dict with the new output's 'hash'
+            and either 'ops' (a diff against base) or 'text' (the whole
+            output, when base is not the output remembered for the cell);
+            outputs_diff describes result['outputs'] relative to the outputs
+            of that earlier reply, or is None when they must be sent whole
+        """
+        text = display_text(result)
+        new_hash = text_hash(text)
+        new_lines = text.split('\n')
+        outputs = result.get('outputs', [])
+
+        with self._lock:
+            previous = self._outputs.pop(cell_id, None)
+            if len(text) <= MAX_DIFF_CHARS:
+                self._outputs[cell_id] = (new_hash, new_lines, outputs)
+                while len(self._outputs) > self.max_cells:
+                    self._outputs.popitem(last=False)
+
+        if base is None or previous is None or previous[0] != base or len(text) > MAX_DIFF_CHARS:
+            return {'hash': new_hash, 'text': text}, None
+
+        old_outputs = previous[2]
+        outputs_diff = [
+            diff_output(i, old_outputs[i], output) if i < len(old_outputs) else {'output': output}
+            for i, output in enumerate(outputs)
+        ]
+
+        if base == new_hash:
+            return {'hash': new_hash, 'base': base, 'ops': []}, outputs_diff
+
+        ops = diff_lines(previous[1], new_lines)
+        # Mostly-changed output is cheaper to send whole than as a diff
+        if ops_size(ops) >= len(text):
+            return {'hash': new_hash, 'text': text}, outputs_diff
+        return {'hash': new_hash, 'base': base, 'ops': ops}, outputs_diff
@@ -0,0 +1,214 @@
+"""
+Compact storage of cell outputs for Accessible Notebooks.
+
+Outputs are kept in nbformat 4 form so saved notebooks open anywhere.
+Long text is truncated, and large rich data (images, HTML tables, ...) is
+moved into a content-addressed blob cache on the server, leaving a
+reference in the output's metadata.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+# Longest text kept for a single output (stream text, text/plain, ...)
+MAX_OUTPUT_TEXT = 50000
+
+# Rich data larger than this goes to the blob cache
+BLOB_THRESHOLD = 32 * 1024
+
+# Key under an output's metadata holding {mimetype: digest} blob references
+BLOB_METADATA_KEY = 'accessible_notebooks_blobs'
+
+# The least recently used blobs are deleted once the cache grows past this
+MAX_BLOB_BYTES = 512 * 1024 * 1024
+
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobStore:
+    """
+    Content-addressed store of output data, one JSON file per blob.
+
+    A blob's modification time is refreshed whenever it is stored or read,
+    and the least recently used blobs are deleted when the store is over
+    max_bytes, so re-running a cell that draws a new plot each time cannot
+    fill the disk.
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BLOB_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Total size of the store, measured on first use
+        self._total = None
+        self._lock = threading.Lock()
+
+    def put(self, mimetype, data):
+        """
+        Store one mimebundle entry.
+
+        Args:
+            mimetype: e.g. 'image/png'
+            data: The entry's value (string, or dict for JSON types)
+
+        Returns:
+            The blob's digest
+        """
+        blob = json.dumps({'mimetype': mimetype, 'data': data}, sort_keys=True)
+        digest = hashlib.sha256(blob.encode('utf-8')).hexdigest()
+        path = self._path(digest)
+
+        if os.path.exists(path):
+            self._touch(path)
+            return digest
+
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(blob)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._measure()
+            self._total += len(blob.encode('utf-8'))
+            if self._total > self.max_bytes:
+                self._prune(keep=path)
+
+        return digest
+
+    def get(self, digest):
+        """
+        Returns:
+            dict with 'mimetype' and 'data' keys, or None if unknown
+        """
+        if not DIGEST.match(digest):
+            return None
+        path = self._path(digest)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                blob = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        return blob
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest)
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _blobs(self):
+        """(mtime, size, path) of every blob."""
+        blobs = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return blobs
+        for entry in entries:
+            if DIGEST.match(entry.name):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+        return blobs
+
+    def _measure(self):
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self._blobs())
+
+    def _prune(self, keep):
+        """Delete the least recently used blobs until under max_bytes."""
+        blobs = sorted(self._blobs())
+        self._total = sum(size for _, size, _ in blobs)
+        for _, size, path in blobs:
+            if self._total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total -= size
+
+
+def join_text(text):
+    """nbformat allows multiline strings to be stored as lists of lines."""
+    return ''.join(text) if isinstance(text, list) else text
+
+
+def truncate_text(text, limit=MAX_OUTPUT_TEXT):
+    text = join_text(text)
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f'\n... [{len(text) - limit} more characters not saved]\n'
+
+
+def is_json_type(mimetype):
+    return mimetype == 'application/json' or mimetype.endswith('+json')
+
+
+def normalize_data(mimetype, value):
+    """Mimebundle value with list-of-lines text joined into one string."""
+    return value if is_json_type(mimetype) else join_text(value)
+
+
+def data_size(mimetype, value):
+    if is_json_type(mimetype):
+        return len(json.dumps(value))
+    return len(value)
+
+
+def compact_output(output, blob_store, blob_threshold=BLOB_THRESHOLD):
+    """
+    Shrink one nbformat output for storage.
+
+    Args:
+        output: An nbformat output dict
+        blob_store: BlobStore for large rich data, or None to drop it
+        blob_threshold: Size above which rich data leaves the output
+
+    Returns:
+        A new, compact output dict
+    """
+    output = dict(output)
+    output_type = output.get('output_type')
+
+    if output_type == 'stream':
+        output['text'] = truncate_text(output.get('text', ''))
+
+    elif output_type == 'error':
+        output['traceback'] = [truncate_text(line) for line in output.get('traceback', [])]
+
+    elif output_type in ('execute_result', 'display_data', 'update_display_data'):
+        data = {}
+        metadata = dict(output.get('metadata', {}))
+        blobs = dict(metadata.get(BLOB_METADATA_KEY, {}))
+
+        for mimetype, value in output.get('data', {}).items():
+            value = normalize_data(mimetype, value)
+            if mimetype == 'text/plain':
+                data[mimetype] = truncate_text(value)
+            elif data_size(mimetype, value) <= blob_threshold:
+                data[mimetype] = value
+            elif blob_store is not None:
+                blobs[mimetype] = blob_store.put(mimetype, value)
+
+        if blobs:
+            metadata[BLOB_METADATA_KEY] = blobs
+        output['data'] = data
+        output['metadata'] = metadata
+
+    return output
+
+
+def compact_outputs(outputs, blob_store, blob_threshold=BLOB_THRESHOLD):
+    return [compact_output(output, blob_store, blob_threshold) for output in outputs]
@@ -3,11 +3,25 @@ Alternative Flask server that serves both frontend and backend.
 This avoids CORS issues entirely by serving everything from the same origin.
 """
 
-from flask import Flask, request, jsonify, send_from_directory, abort
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory, abort
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import atexit
+import json
 import os
 from kernel_manager import NotebookKernelManager
+from kernel_pool import KernelSpecCache, WarmKernelPool
+from kernel_registry import KernelRegistry
+from graceful_shutdown import GracefulShutdown
+from compression import StaticAssetCache, compress_response
+from introspection import IntrospectionCache
+from variable_inspector import VariableInspector, DEFAULT_PAGE_SIZE
+from kernel_monitor import DEAD, TRANSITIONAL_STATES
+from output_store import BlobStore, compact_outputs
+from notebook_store import NotebookStore, NotebookFormatError, EXTERNALIZE_OUTPUTS
+from exporter import NotebookExporter, FORMATS
+from history import ExecutionHistory
+from output_diff import OutputDiffer
 
 app = Flask(__name__)
 limiter = Limiter(get_remote_address, app=app, default_limits=[])
@@ -34,20 +48,79 @@ def add_security_headers(response):
     return response
 
 
-# Global kernel manager instance
-kernel = NotebookKernelManager()
+@app.after_request
+def compress_api_response(response):
+    return compress_response(response, request.headers.get('Accept-Encoding'))
+
 
 # Path to frontend directory
 FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'frontend')
 
+NOTEBOOKS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'notebooks')
+
+# Every kernel we start is recorded, so kernels left running by a server
+# that crashed or was killed are shut down when the next one starts
+kernel_registry = KernelRegistry(os.path.join(NOTEBOOKS_DIR, '.kernels.json'))
+reaped = kernel_registry.reap_orphans()
+if reaped:
+    print(f'Shut down {reaped} kernel(s) left running by a previous server')
+
+# Installed kernelspecs, and kernels started ahead of time for the most used
+kernel_specs = KernelSpecCache()
+kernel_pool = WarmKernelPool(kernel_specs)
+kernel_pool.on_start = kernel_registry.register
+kernel_pool.on_shutdown = kernel_registry.unregister
+kernel_pool.start()
+
+# Global kernel manager instance
+kernel = NotebookKernelManager(pool=kernel_pool, registry=kernel_registry)
+introspection = IntrospectionCache(kernel)
+variable_inspector = VariableInspector(kernel)
+
+# Large rich outputs are kept here and referenced from saved notebooks
+blob_store = BlobStore(os.path.join(NOTEBOOKS_DIR, '.blobs'))
+notebook_store = NotebookStore(NOTEBOOKS_DIR, blob_store)
+exporter = NotebookExporter(notebook_store, blob_store, os.path.join(NOTEBOOKS_DIR, '.exports'))
+
+# Every execution is logged; writes happen in the background
+history = ExecutionHistory(os.path.join(NOTEBOOKS_DIR, '.history.sqlite3'))
+history.start()
+kernel.execution_listeners.append(history.record_execution)
+
+# Last output of each cell, so re-runs can send only the changed lines
+output_differ = OutputDiffer()
+
+# On exit (or SIGTERM/SIGINT when run directly), let running cells finish,
+# then shut down all kernels at once
+lifecycle = GracefulShutdown()
+lifecycle.parallel_tasks += [kernel.shutdown, kernel_pool.shutdown]
+lifecycle.final_tasks += [kernel.monitor.stop, history.close]
+atexit.register(lifecycle.shutdown)
+
+
+def shutting_down_response():
+    return jsonify({
+        'status': 'error',
+        'error': {
+            'ename': 'ServerShuttingDown',
+            'evalue': 'The server is shutting down',
+            'traceback': []
+        },
+        'output': []
+    }), 503
+
 ALLOWED_EXTENSIONS = {'.html', '.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.json', '.woff', '.woff2', '.ttf', '.map'}
 
+# Frontend files are hashed and precompressed once; restart to pick up edits
+static_assets = StaticAssetCache(FRONTEND_DIR, ALLOWED_EXTENSIONS)
+static_assets.load()
+
 
 # Serve frontend files
 @app.route('/')
 def index():
     """Serve the main HTML file."""
-    return send_from_directory(FRONTEND_DIR, 'index.html')
+    return static_assets.send('index.html', request) or send_from_directory(FRONTEND_DIR, 'index.html')
 
 
 @app.route('/<path:path>')
@@ -56,6 +129,9 @@ def serve_static(path):
     ext = os.path.splitext(path)[1].lower()
     if ext not in ALLOWED_EXTENSIONS:
         abort(403)
+    response = static_assets.send(path, request)
+    if response is not None:
+        return response
     return send_from_directory(FRONTEND_DIR, path)
 
 
@@ -65,20 +141,93 @@ def serve_static(path):
 @app.route('/api/status', methods=['GET'])
 @limiter.limit("30/minute")
 def status():
+    snapshot = kernel.monitor.snapshot()
     return jsonify({
         'status': 'ok',
-        'kernel_alive': kernel.is_alive()
+        'kernel_alive': snapshot['alive'],
+        'kernel_state': snapshot['state'],
+        'kernel_name': kernel.kernel_name,
+        'pending_input': kernel.pending_input_request(),
+        'state_changed_at': snapshot['changed_at']
     })
 
 
+# Seconds between keepalive comments on an idle status stream; lets the
+# server notice clients that have gone away.
+STATUS_STREAM_KEEPALIVE = 15
+
+
+@app.route('/api/status/stream', methods=['GET'])
+@limiter.limit("30/minute")
+def status_stream():
+    """Push kernel state changes to the client as server-sent events."""
+    def events():
+        seen_version = None
+        while True:
+            snapshot = kernel.monitor.wait_for_change(seen_version, timeout=STATUS_STREAM_KEEPALIVE)
+            if snapshot is None:
+                yield ': keepalive\n\n'
+                continue
+            seen_version = snapshot['version']
+            yield f"data: {json.dumps(dict(snapshot, kernel_name=kernel.kernel_name))}\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@app.route('/api/kernelspecs', methods=['GET'])
+@limiter.limit("30/minute")
+def list_kernelspecs():
+    return jsonify({
+        'status': 'ok',
+        'default': kernel_specs.default_name,
+        'kernelspecs': kernel_specs.get_all()
+    })
+
+
+def get_kernel_name():
+    """
+    The kernelspec named in a start or restart request.
+
+    Returns:
+        (kernel_name, error_response) tuple; kernel_name is None when the
+        request names none, error_response is None if valid
+    """
+    MAX_PAYLOAD_BYTES = 1 * 1024 * 1024  # 1MB
+    if request.content_length and request.content_length > MAX_PAYLOAD_BYTES:
+        abort(413)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+
+    kernel_name = data.get('kernel_name')
+    if kernel_name is None:
+        return None, None
+    if not isinstance(kernel_name, str) or not kernel_specs.exists(kernel_name):
+        return None, (jsonify({'status': 'error', 'message': f'No kernel named {kernel_name}'}), 404)
+    return kernel_name, None
+
+
 @app.route('/api/start', methods=['POST'])
 @limiter.limit("30/minute")
 def start_kernel():
     check_origin()
-    result = kernel.start()
+    if lifecycle.draining:
+        return jsonify({'status': 'error', 'message': 'The server is shutting down'}), 503
+    kernel_name, error_response = get_kernel_name()
+    if error_response is not None:
+        return error_response
+
+    result = kernel.start(kernel_name)
     return jsonify(result)
 
 
+# Longest an execution waits for a start or restart already in progress
+KERNEL_START_WAIT = 60
+
+
 @app.route('/api/execute', methods=['POST'])
 @limiter.limit("30/minute")
 def execute_code():
@@ -101,29 +250,336 @@ def execute_code():
 
     code = data['code']
 
-    if not kernel.is_alive():
-        start_result = kernel.start()
-        if start_result['status'] != 'ok':
-            return jsonify({
-                'status': 'error',
-                'error': {
-                    'ename': 'KernelStartError',
-                    'evalue': start_result.get('message', 'Failed to start kernel'),
-                    'traceback': []
-                },
-                'output': []
-            }), 500
-
-    result = kernel.execute(code)
+    # With a cell_id and diff: true, the reply carries 'diff' (see
+    # output_diff) in place of 'output'; 'base' is the hash of the output
+    # the client shows, from the previous reply's diff. When base matches,
+    # 'outputs_diff' also replaces 'outputs'.
+    cell_id = data.get('cell_id')
+    if not isinstance(cell_id, str) or not 0 < len(cell_id) <= 64:
+        cell_id = None
+    base = data.get('base') if isinstance(data.get('base'), str) else None
+
+    if not lifecycle.begin():
+        return shutting_down_response()
+    try:
+        # Another request is starting or restarting the kernel: wait for it
+        # rather than starting a second one
+        if kernel.monitor.state in TRANSITIONAL_STATES and not kernel.monitor.wait_until_settled(KERNEL_START_WAIT):
+            if kernel.monitor.state in TRANSITIONAL_STATES:
+                return jsonify({
+                    'status': 'error',
+                    'error': {
+                        'ename': 'KernelStarting',
+                        'evalue': 'The kernel is still starting; try again shortly',
+                        'traceback': []
+                    },
+                    'output': []
+                }), 409
+
+        if not kernel.monitor.alive:
+            # A dead kernel still holds its manager, so it has to be restarted
+            start_result = kernel.restart() if kernel.monitor.state == DEAD else kernel.start()
+            if start_result['status'] != 'ok':
+                return jsonify({
+                    'status': 'error',
+                    'error': {
+                        'ename': 'KernelStartError',
+                        'evalue': start_result.get('message', 'Failed to start kernel'),
+                        'traceback': []
+                    },
+                    'output': []
+                }), 500
+
+        result = kernel.execute(code, cell_id)
+    finally:
+        lifecycle.end()
+
+    result = store_outputs(result)
+    if data.get('diff') and cell_id is not None and result['status'] != 'input_requested':
+        diff, outputs_diff = output_differ.update(cell_id, result, base)
+        result = dict(result, diff=diff)
+        del result['output']
+        if outputs_diff is not None:
+            result['outputs_diff'] = outputs_diff
+            del result['outputs']
     return jsonify(result)
 
 
+@app.route('/api/input', methods=['GET'])
+@limiter.limit("30/minute")
+def get_pending_input():
+    """The input() prompt a cell is paused on, if any, with its execution_id."""
+    return jsonify({'status': 'ok', 'pending_input': kernel.pending_input_request()})
+
+
+@app.route('/api/input', methods=['POST'])
+@limiter.limit("30/minute")
+def send_input():
+    """Answer a cell's input() prompt, or cancel it, and resume execution."""
+    check_origin()
+    MAX_PAYLOAD_BYTES = 1 * 1024 * 1024  # 1MB
+    if request.content_length and request.content_length > MAX_PAYLOAD_BYTES:
+        abort(413)
+    data = request.get_json(silent=True)
+
+    if not data or 'execution_id' not in data:
+        return jsonify({
+            'status': 'error',
+            'error': {
+                'ename': 'BadRequest',
+                'evalue': 'Missing execution_id parameter',
+                'traceback': []
+            },
+            'output': []
+        }), 400
+
+    value = data.get('value', '')
+    if not isinstance(value, str):
+        value = str(value)
+
+    if not lifecycle.begin():
+        return shutting_down_response()
+    try:
+        result = kernel.send_input(data['execution_id'], value, cancel=bool(data.get('cancel')))
+    finally:
+        lifecycle.end()
+    return jsonify(store_outputs(result))
+
+
+def store_outputs(result):
+    """Make a finished execution's nbformat outputs compact enough to save."""
+    if 'outputs' in result and result['status'] != 'input_requested':
+        result['outputs'] = compact_outputs(result['outputs'], blob_store)
+    return result
+
+
+@app.route('/api/blobs/<digest>', methods=['GET'])
+@limiter.limit("120/minute")
+def get_blob(digest):
+    """Output data moved out of a saved notebook; immutable, since it is addressed by content."""
+    blob = blob_store.get(digest)
+    if blob is None:
+        abort(404)
+    response = jsonify(dict(blob, status='ok'))
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+
+MAX_IMPORT_BYTES = 1024 * 1024 * 1024  # 1GB
+
+
+@app.route('/api/notebooks/import', methods=['POST'])
+@limiter.limit("10/minute")
+def import_notebook():
+    """
+    Store an uploaded notebook, parsing it as it streams in.
+
+    The request body is the raw .ipynb file; 'name' and 'outputs'
+    ('keep', 'externalize' or 'strip') are query parameters.
+    """
+    check_origin()
+    if request.content_length and request.content_length > MAX_IMPORT_BYTES:
+        abort(413)
+
+    try:
+        index = notebook_store.import_stream(
+            request.args.get('name', ''),
+            request.stream,
+            outputs=request.args.get('outputs', EXTERNALIZE_OUTPUTS)
+        )
+    except NotebookFormatError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    return jsonify(dict(index, status='ok'))
+
+
+@app.route('/api/notebooks/<name>', methods=['GET'])
+@limiter.limit("30/minute")
+def get_notebook_index(name):
+    """Metadata and a one-line summary of each cell of a stored notebook."""
+    index = notebook_store.get_index(name)
+    if index is None:
+        abort(404)
+    return jsonify(dict(index, status='ok'))
+
+
+@app.route('/api/notebooks/<name>/cells', methods=['GET'])
+@limiter.limit("120/minute")
+def get_notebook_cells(name):
+    """A page of full cells from a stored notebook ('offset', 'limit' query parameters)."""
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    page = notebook_store.get_cells(name, offset, limit)
+    if page is None:
+        abort(404)
+    return jsonify(dict(page, status='ok'))
+
+
+@app.route('/api/export', methods=['POST'])
+@limiter.limit("30/minute")
+def export_notebook():
+    """
+    Queue an export to accessible HTML or plain text.
+
+    The body names a stored notebook ('name') or carries one ('notebook'),
+    plus 'format' ('html' or 'text'). Poll /api/export/<job_id> for the result.
+    """
+    check_origin()
+    MAX_PAYLOAD_BYTES = 50 * 1024 * 1024  # 50MB
+    if request.content_length and request.content_length > MAX_PAYLOAD_BYTES:
+        abort(413)
+    data = request.get_json(silent=True)
+
+    if not isinstance(data, dict) or not isinstance(data.get('format'), str) or data['format'] not in FORMATS:
+        return jsonify({'status': 'error', 'message': "format must be 'html' or 'text'"}), 400
+
+    name = data.get('name')
+    notebook = data.get('notebook')
+    if name is not None and not isinstance(name, str):
+        return jsonify({'status': 'error', 'message': 'name must be a string'}), 400
+    if name is not None:
+        if notebook_store.get_index(name) is None:
+            return jsonify({'status': 'error', 'message': f'No stored notebook named {name}'}), 404
+    elif not isinstance(notebook, dict) or not isinstance(notebook.get('cells'), list):
+        return jsonify({'status': 'error', 'message': 'Missing name or notebook parameter'}), 400
+    elif not isinstance(notebook.get('metadata', {}), dict):
+        return jsonify({'status': 'error', 'message': 'Notebook metadata must be an object'}), 400
+    elif not isinstance(notebook.get('metadata', {}).get('title') or '', str):
+        return jsonify({'status': 'error', 'message': 'Notebook title must be a string'}), 400
+
+    return jsonify(exporter.submit(data['format'], name=name, notebook=notebook))
+
+
+@app.route('/api/export/<job_id>', methods=['GET'])
+@limiter.limit("120/minute")
+def export_status(job_id):
+    status = exporter.job_status(job_id)
+    if status is None:
+        abort(404)
+    return jsonify(status)
+
+
+@app.route('/api/exports/<filename>', methods=['GET'])
+@limiter.limit("30/minute")
+def download_export(filename):
+    """A finished export; the name is its content hash, so it never changes."""
+    path = exporter.export_path(filename)
+    if path is None:
+        abort(404)
+    extension = os.path.splitext(filename)[1][1:]
+    fmt = 'html' if extension == 'html' else 'text'
+    download_name = request.args.get('download_name', f'notebook.{extension}')
+    return send_file(
+        path,
+        mimetype=FORMATS[fmt]['mimetype'],
+        as_attachment=True,
+        download_name=os.path.splitext(os.path.basename(download_name))[0] + f'.{extension}',
+        max_age=31536000
+    )
+
+
+def get_introspection_request():
+    """
+    Validate the body of a completion or inspection request.
+
+    Returns:
+        (code, cursor_pos, error_response) tuple; error_response is None if valid
+    """
+    MAX_PAYLOAD_BYTES = 1 * 1024 * 1024  # 1MB
+    if request.content_length and request.content_length > MAX_PAYLOAD_BYTES:
+        abort(413)
+    data = request.get_json(silent=True)
+
+    if not isinstance(data, dict) or not isinstance(data.get('code'), str):
+        return None, None, (jsonify({'status': 'error', 'message': 'Missing code parameter'}), 400)
+
+    code = data['code']
+    cursor_pos = data.get('cursor_pos', len(code))
+    if not isinstance(cursor_pos, int) or not 0 <= cursor_pos <= len(code):
+        return None, None, (jsonify({'status': 'error', 'message': 'Invalid cursor_pos parameter'}), 400)
+
+    if not kernel.monitor.alive:
+        return None, None, (jsonify({'status': 'error', 'message': 'Kernel not running'}), 409)
+
+    return code, cursor_pos, None
+
+
+# Completion and inspection are requested while typing, so they get a
+# higher limit than the other endpoints.
+@app.route('/api/complete', methods=['POST'])
+@limiter.limit("120/minute")
+def complete_code():
+    check_origin()
+    code, cursor_pos, error_response = get_introspection_request()
+    if error_response is not None:
+        return error_response
+
+    return jsonify(introspection.complete(code, cursor_pos))
+
+
+@app.route('/api/inspect', methods=['POST'])
+@limiter.limit("120/minute")
+def inspect_code():
+    check_origin()
+    code, cursor_pos, error_response = get_introspection_request()
+    if error_response is not None:
+        return error_response
+
+    detail_level = 1 if request.get_json().get('detail_level') == 1 else 0
+    return jsonify(introspection.inspect(code, cursor_pos, detail_level))
+
+
+@app.route('/api/variables', methods=['GET'])
+@limiter.limit("30/minute")
+def list_variables():
+    if not kernel.monitor.alive:
+        return jsonify({'status': 'error', 'message': 'Kernel not running'}), 409
+
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return jsonify(variable_inspector.summarize(offset, limit))
+
+
+@app.route('/api/history', methods=['GET'])
+@limiter.limit("30/minute")
+def search_history():
+    """
+    Search past executions, newest first.
+
+    Query parameters: 'session' (kernel id, or 'current'), 'code_hash', 'q'
+    (text in the code), 'since' and 'until' (Unix seconds), 'limit', 'offset'.
+    """
+    session = request.args.get('session')
+    if session == 'current':
+        session = kernel.kernel_id
+        if not session:
+            # No kernel running, so no current session to have history
+            return jsonify({'status': 'ok', 'entries': []})
+
+    entries = history.search(
+        session=session,
+        code_hash=request.args.get('code_hash'),
+        text=request.args.get('q'),
+        since=request.args.get('since', type=float),
+        until=request.args.get('until', type=float),
+        limit=request.args.get('limit', 50, type=int),
+        offset=request.args.get('offset', 0, type=int)
+    )
+    return jsonify({'status': 'ok', 'entries': entries})
+
 
 @app.route('/api/restart', methods=['POST'])
 @limiter.limit("30/minute")
 def restart_kernel():
     check_origin()
-    result = kernel.restart()
+    if lifecycle.draining:
+        return jsonify({'status': 'error', 'message': 'The server is shutting down'}), 503
+    kernel_name, error_response = get_kernel_name()
+    if error_response is not None:
+        return error_response
+
+    result = kernel.restart(kernel_name)
     return jsonify(result)
 
 
@@ -138,6 +594,11 @@ def shutdown_kernel():
 @app.route('/health', methods=['GET'])
 @limiter.limit("30/minute")
 def health():
+    if lifecycle.draining:
+        return jsonify({
+            'status': 'shutting down',
+            'service': 'accessible-notebooks-backend'
+        }), 503
     return jsonify({
         'status': 'healthy',
         'service': 'accessible-notebooks-backend'
@@ -155,4 +616,9 @@ if __name__ == '__main__':
     print("\nPress CTRL+C to stop the server")
     print()
 
-    app.run(host='127.0.0.1', port=5000, debug=False)
\ No newline at end of file
+    lifecycle.install_signal_handlers()
+    try:
+        app.run(host='127.0.0.1', port=5000, debug=False)
+    except KeyboardInterrupt:
+        # Raised instead of a second SIGINT on Python before 3.10
+        pass
\ No newline at end of file
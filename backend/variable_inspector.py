@@ -0,0 +1,165 @@
+"""
+Variable inspector for Accessible Notebooks.
+
+Summarizes the variables in the kernel's namespace without producing their
+full reprs. The summarizing runs inside the kernel, so a large DataFrame or
+array never crosses IOPub or gets serialized to JSON; only a few hundred
+bytes per variable come back.
+"""
+
+import ast
+import json
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# How many items (elements, rows, columns, keys) and characters a preview shows
+PREVIEW_ITEMS = 5
+PREVIEW_CHARS = 80
+
+# Objects of unfamiliar types longer than this get no preview; their repr
+# could be arbitrarily expensive.
+MAX_GENERIC_PREVIEW_LENGTH = 1000
+
+HELPER_NAME = '_accessible_notebooks_variables'
+
+# Source of the function run in the kernel. It only looks at libraries the
+# user has already imported, and never calls repr() on containers of
+# unknown size.
+HELPER_SOURCE = '''
+def _accessible_notebooks_variables(offset, limit, max_items, max_chars, max_generic_length):
+    import json, math, reprlib, sys, types
+
+    ip = get_ipython()
+    hidden = ip.user_ns_hidden
+    names = sorted(
+        name for name, value in list(ip.user_ns.items())
+        if not name.startswith('_') and name not in hidden
+        and not isinstance(value, types.ModuleType)
+    )
+
+    short = reprlib.Repr()
+    short.maxlevel = 2
+    short.maxlist = short.maxtuple = short.maxset = short.maxfrozenset = max_items
+    short.maxdeque = short.maxarray = short.maxdict = max_items
+    short.maxstring = short.maxlong = short.maxother = max_chars
+
+    numpy = sys.modules.get('numpy')
+    pandas = sys.modules.get('pandas')
+
+    def number(x):
+        x = float(x)
+        return x if math.isfinite(x) else str(x)
+
+    def memory(value):
+        try:
+            if pandas is not None and isinstance(value, (pandas.DataFrame, pandas.Series)):
+                usage = value.memory_usage(index=True, deep=False)
+                return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+            nbytes = getattr(value, 'nbytes', None)
+            if isinstance(nbytes, int):
+                return nbytes
+        except Exception:
+            pass
+        return sys.getsizeof(value)
+
+    def summarize(name, value):
+        cls = type(value)
+        info = {
+            'name': name,
+            'type': cls.__name__ if cls.__module__ == 'builtins' else cls.__module__ + '.' + cls.__qualname__
+        }
+
+        length = None
+        try:
+            shape = getattr(value, 'shape', None)
+            if isinstance(shape, tuple):
+                info['shape'] = [int(n) for n in shape]
+            else:
+                length = len(value)
+                info['length'] = length
+        except Exception:
+            pass
+
+        try:
+            dtype = getattr(value, 'dtype', None)
+            if dtype is not None:
+                info['dtype'] = str(dtype)
+        except Exception:
+            pass
+
+        info['memory'] = memory(value)
+
+        try:
+            if pandas is not None and isinstance(value, pandas.DataFrame):
+                columns = list(value.columns[:max_items])
+                info['columns'] = [str(c) + ': ' + str(value.dtypes.iloc[i]) for i, c in enumerate(columns)]
+                info['preview'] = short.repr(value.iloc[:max_items, :max_items].values.tolist())
+            elif pandas is not None and isinstance(value, pandas.Series):
+                info['preview'] = short.repr(value.iloc[:max_items].tolist())
+            elif numpy is not None and isinstance(value, numpy.ndarray):
+                info['preview'] = short.repr(value.flat[:max_items].tolist())
+                if value.size and value.dtype.kind in 'biuf':
+                    info['summary'] = {
+                        'min': number(value.min()),
+                        'max': number(value.max()),
+                        'mean': number(value.mean())
+                    }
+            elif isinstance(value, (str, bytes, int, float, complex, bool, type(None),
+                                    list, tuple, dict, set, frozenset)):
+                info['preview'] = short.repr(value)
+            elif length is None or length <= max_generic_length:
+                info['preview'] = short.repr(value)
+        except Exception as e:
+            info['preview_error'] = type(e).__name__
+
+        return info
+
+    page = names[offset:offset + limit]
+    return json.dumps({
+        'total': len(names),
+        'offset': offset,
+        'limit': limit,
+        'variables': [summarize(name, ip.user_ns[name]) for name in page if name in ip.user_ns]
+    }, default=str)
+'''
+
+
+class VariableInspector:
+    """
+    Fetches paginated variable summaries from a NotebookKernelManager.
+    """
+
+    def __init__(self, kernel):
+        self.kernel = kernel
+
+    def summarize(self, offset=0, limit=DEFAULT_PAGE_SIZE):
+        """
+        Summarize one page of the kernel's variables, sorted by name.
+
+        Args:
+            offset: Index of the first variable to return
+            limit: Maximum number of variables to return
+
+        Returns:
+            dict with 'status', 'total', 'offset', 'limit' and 'variables' keys
+        """
+        offset = max(0, offset)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        expression = (
+            f'{HELPER_NAME}({offset}, {limit}, {PREVIEW_ITEMS}, '
+            f'{PREVIEW_CHARS}, {MAX_GENERIC_PREVIEW_LENGTH})'
+        )
+
+        reply = self.kernel.evaluate(HELPER_SOURCE, expression)
+        if reply['status'] != 'ok':
+            return reply
+
+        try:
+            # The helper returns a JSON string; text/plain is that string's repr
+            summary = json.loads(ast.literal_eval(reply['data']['text/plain']))
+        except (KeyError, ValueError, SyntaxError) as e:
+            return {'status': 'error', 'message': f'Could not read variable summary: {str(e)}'}
+
+        summary['status'] = 'ok'
+        return summary
@@ -15,6 +15,14 @@ const notebookTable = notebook.querySelector('table tbody');
 let currentCell = null;
 let clipboard = null;
 
+// Last execution of each code cell, in nbformat form, so it can be saved:
+// { outputs, execution_count, timing }
+const cellOutputs = new WeakMap();
+
+// Hash of the output text each code cell shows, as the server reported it;
+// sent with the next run so the server can reply with only changed lines
+let outputHashes = new WeakMap();
+
 // ============================================================================
 // Utility Functions
 // ============================================================================
@@ -75,6 +83,68 @@ function hasModifierKeys(e) {
     return e.ctrlKey || e.altKey || e.shiftKey;
 } // hasModifierKeys
 
+// Wraps an async function so that rapid calls collapse into one:
+// only the last call within wait ms runs; superseded calls resolve to null.
+function debounceAsync(fn, wait) {
+    let timer = null;
+    let resolvePending = null;
+
+    return (...args) => new Promise(resolve => {
+        if (timer) {
+            clearTimeout(timer);
+            resolvePending(null);
+        } // if pending
+
+        resolvePending = resolve;
+        timer = setTimeout(async () => {
+            timer = null;
+            try {
+                resolve(await fn(...args));
+            } catch (error) {
+                console.error(error);
+                resolve(null);
+            } // try
+        }, wait);
+    });
+} // debounceAsync
+
+// Caret position within a contenteditable element, as a character offset
+
+function getCaretOffset(element) {
+    const selection = window.getSelection();
+    if (selection.rangeCount === 0 || not(element.contains(selection.anchorNode))) {
+        return element.textContent.length;
+    } // if no caret
+
+    const range = selection.getRangeAt(0).cloneRange();
+    range.selectNodeContents(element);
+    range.setEnd(selection.focusNode, selection.focusOffset);
+    return range.toString().length;
+} // getCaretOffset
+
+function setCaretOffset(element, offset) {
+    const walker = document.createTreeWalker(element, NodeFilter.SHOW_TEXT);
+    let node = walker.nextNode();
+
+    while (node && offset > node.textContent.length) {
+        offset -= node.textContent.length;
+        node = walker.nextNode();
+    } // while
+
+    const range = document.createRange();
+    if (node) {
+        range.setStart(node, offset);
+    } else {
+        range.selectNodeContents(element);
+        range.collapse(false);
+    } // if node
+
+    range.collapse(true);
+    const selection = window.getSelection();
+    selection.removeAllRanges();
+    selection.addRange(range);
+} // setCaretOffset
+
 // ============================================================================
 // notebook, and Cell Navigation, & Accessors
 // ============================================================================
@@ -108,6 +178,10 @@ function getCellToolbar(cell) {
     return cell.querySelector(".toolbar");
 } // getCellToolbar
 
+function getAssistContainer(cell) {
+    return cell.querySelector(".assist");
+} // getAssistContainer
+
 // ============================================================================
 // Predicates
 // ============================================================================
@@ -129,6 +203,10 @@ function isCodeContainer(x) {
     return x && x.matches && x.matches(".code");
 } // isCodeContainer
 
+function isInStdinForm(x) {
+    return x && x.closest && Boolean(x.closest(".stdin"));
+} // isInStdinForm
+
 function isToolbarContainer(x) {
     return x && x.matches && x.matches(".toolbar");
 } // isToolbarContainer
@@ -154,6 +232,8 @@ function isCodeCell (cell) {
 const notebookFileInput = document.getElementById('notebook-file-input');
 const saveNotebookBtn = document.getElementById('save-notebook-btn');
 const newNotebookBtn = document.getElementById('new-notebook-btn');
+const exportHtmlBtn = document.getElementById('export-html-btn');
+const exportTextBtn = document.getElementById('export-text-btn');
 const addCellBtn = document.getElementById('add-cell-btn');
 const notebookNameDisplay = document.getElementById('notebook-name');
 
@@ -164,42 +244,82 @@ const notebookNameDisplay = document.getElementById('notebook-name');
 let kernelAlive = false;
 let activeCell = null;
 let currentNotebookName = 'Untitled.ipynb';
+// Metadata of the loaded notebook, kept so saving does not lose it
+let notebookMetadata = {};
+// Kernelspec of the running kernel, and all installed kernelspecs by name
+let currentKernelName = null;
+let kernelspecs = {};
 
 // ============================================================================
 // Kernel Management
 // ============================================================================
 
-function updateKernelStatus(alive) {
+// Busy and idle only change a class: the status is a live region, and
+// announcing every cell run would drown out the output.
+const kernelStateText = {
+    idle: 'Kernel: Running',
+    busy: 'Kernel: Running',
+    starting: 'Kernel: Starting',
+    restarting: 'Kernel: Restarting',
+    dead: 'Kernel: Dead',
+    stopped: 'Kernel: Not Running'
+}; // kernelStateText
+
+function updateKernelStatus(alive, state = alive ? 'idle' : 'stopped', kernelName = currentKernelName) {
     kernelAlive = alive;
+    currentKernelName = kernelName;
 
-    if (alive) {
-        kernelStatus.textContent = 'Kernel: Running';
-        kernelStatus.classList.add('active');
-        kernelStatus.classList.remove('error');
-    } else {
-        kernelStatus.textContent = 'Kernel: Not Running';
-        kernelStatus.classList.remove('active');
-        kernelStatus.classList.remove('error');
-    } // if alive
+    let text = kernelStateText[state] || kernelStateText.stopped;
+    const spec = kernelspecs[kernelName];
+    if (alive && spec) text += ` (${spec.display_name})`;
+    if (kernelStatus.textContent.trim() !== text) kernelStatus.textContent = text;
+    kernelStatus.classList.toggle('active', alive);
+    kernelStatus.classList.toggle('busy', state === 'busy');
+    kernelStatus.classList.toggle('error', state === 'dead');
 
     // Enable/disable buttons
     startKernelBtn.disabled = alive;
-    restartKernelBtn.disabled = not(alive);
-    shutdownKernelBtn.disabled = not(alive);
+    restartKernelBtn.disabled = not(alive || state === 'dead');
+    shutdownKernelBtn.disabled = not(alive || state === 'dead');
 } // updateKernelStatus
 
-async function startKernel() {
+async function loadKernelspecs() {
+    try {
+        const response = await fetch(`${API_BASE}/kernelspecs`);
+        const result = await response.json();
+        if (result.status === 'ok') kernelspecs = result.kernelspecs;
+    } catch (error) {
+        console.error('Error listing kernels:', error);
+    } // try
+} // loadKernelspecs
+
+// The kernelspec named in the loaded notebook's metadata, if it has one
+function notebookKernelName() {
+    const spec = notebookMetadata.kernelspec;
+    return spec && typeof spec.name === 'string' ? spec.name : null;
+} // notebookKernelName
+
+function kernelRequest(kernelName) {
+    return {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        // Kernels that are not installed here fall back to the default
+        body: JSON.stringify(kernelspecs[kernelName] ? { kernel_name: kernelName } : {})
+    };
+} // kernelRequest
+
+async function startKernel(kernelName = notebookKernelName()) {
     try {
         startKernelBtn.disabled = true;
 
-        const response = await fetch(`${API_BASE}/start`, {
-            method: 'POST'
-        });
+        const response = await fetch(`${API_BASE}/start`, kernelRequest(kernelName));
 
         const result = await response.json();
 
         if (result.status === 'ok') {
-            updateKernelStatus(true);
+            updateKernelStatus(true, 'idle', result.kernel_name);
         } else {
             kernelStatus.classList.add('error');
         } // if status
@@ -214,20 +334,20 @@ async function restartKernel() {
     try {
         restartKernelBtn.disabled = true;
 
-        const response = await fetch(`${API_BASE}/restart`, {
-            method: 'POST'
-        });
+        const response = await fetch(`${API_BASE}/restart`, kernelRequest(notebookKernelName()));
 
         const result = await response.json();
 
         if (result.status === 'ok') {
-            updateKernelStatus(true);
+            updateKernelStatus(true, 'idle', result.kernel_name);
 
             // Clear all outputs
             document.querySelectorAll('.output').forEach(output => {
                 output.textContent = '';
                 output.classList.remove('has-output', 'has-error');
             });
+            document.querySelectorAll('.cell').forEach(cell => cellOutputs.delete(cell));
+            outputHashes = new WeakMap();
         } // if status
     } catch (error) {
         console.error('Error restarting kernel:', error);
@@ -236,6 +356,31 @@ async function restartKernel() {
     } // try
 } // restartKernel
 
+// Switch to the kernel a newly loaded notebook asks for, keeping its outputs
+async function useNotebookKernel() {
+    const kernelName = notebookKernelName();
+    if (not(kernelName) || kernelName === currentKernelName) return;
+
+    if (not(kernelspecs[kernelName])) {
+        alert(`This notebook uses the ${notebookMetadata.kernelspec.display_name || kernelName} kernel, which is not installed. Cells will run in the current kernel.`);
+        return;
+    } // if not installed
+
+    try {
+        const action = kernelAlive ? 'restart' : 'start';
+        const response = await fetch(`${API_BASE}/${action}`, kernelRequest(kernelName));
+        const result = await response.json();
+
+        if (result.status === 'ok') {
+            updateKernelStatus(true, 'idle', result.kernel_name);
+        } else {
+            console.error('Error switching kernel:', result.message);
+        } // if status
+    } catch (error) {
+        console.error('Error switching kernel:', error);
+    } // try
+} // useNotebookKernel
+
 async function shutdownKernel() {
     try {
         shutdownKernelBtn.disabled = true;
@@ -262,7 +407,7 @@ async function checkStatus() {
         const result = await response.json();
 
         if (result.status === 'ok') {
-            updateKernelStatus(result.kernel_alive);
+            updateKernelStatus(result.kernel_alive, result.kernel_state, result.kernel_name);
         } // if status
     } catch (error) {
         console.error('Error checking status:', error);
@@ -270,6 +415,23 @@ async function checkStatus() {
     } // try
 } // checkStatus
 
+// The server pushes every kernel state change; EventSource reconnects by itself
+function subscribeToStatus() {
+    if (not(window.EventSource)) {
+        checkStatus();
+        return;
+    } // if no EventSource
+
+    const events = new EventSource(`${API_BASE}/status/stream`);
+    events.addEventListener('message', e => {
+        const status = JSON.parse(e.data);
+        updateKernelStatus(status.alive, status.state, status.kernel_name);
+    });
+    events.addEventListener('error', () => {
+        console.error('Kernel status stream interrupted; reconnecting.');
+    });
+} // subscribeToStatus
+
 // ============================================================================
 // Cell Type Functions
 // ============================================================================
@@ -293,6 +455,11 @@ function toggleCellType(cell) {
     const newType = currentType === 'code' ? 'markdown' : 'code';
     //console.log(`Toggling cell from ${currentType} to ${newType}`);
     setCellType(cell, newType);
+
+    // The output shown no longer matches what the server would diff against,
+    // and a markdown cell has no outputs to save
+    outputHashes.delete(cell);
+    if (newType !== 'code') cellOutputs.delete(cell);
 } // toggleCellType
 
 function cutCell (cell) {
@@ -372,17 +539,28 @@ async function executeCell(cell) {
         return;
     } // if no code
 
+    // Still waiting for an answer from the last run
+    if (hasOpenPrompt(cell)) {
+        focusPrompt(cell);
+        return;
+    } // if prompt open
+
     try {
         // Update UI
         runBtn.disabled = true;
         runBtn.classList.add('executing');
         runBtn.textContent = 'Executing...';
-        outputContainer.textContent = '';
+        // Output that may be patched by a diff stays up until the reply arrives
+        if (cellType === 'markdown' || not(outputHashes.has(cell))) {
+            outputContainer.textContent = '';
+        } // if not patchable
         outputContainer.classList.remove('has-output', 'has-error', 'markdown-rendered');
 
         // Handle markdown cells
         if (cellType === 'markdown') {
 //            console.log('Rendering markdown client-side...');
+            outputHashes.delete(cell);
+            cellOutputs.delete(cell);
 
             try {
                 // Normalize line endings: Windows CRLF to Unix LF
@@ -445,45 +623,41 @@ async function executeCell(cell) {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ code })
+            body: JSON.stringify({
+                code,
+                cell_id: cell.dataset.cellId,
+                diff: true,
+                // A diff of the saved outputs needs the saved copy to apply to
+                base: (cellOutputs.has(cell) && outputHashes.get(cell)) || null
+            })
         });
 
-        const result = await response.json();
-
-        // Remove aria-live for code cells to prevent double speaking
-
-        // Display output
-        if (result.status === 'ok') {
-            if (result.output && result.output.length > 0) {
-                const outputText = result.output.map(item => {
-                    if (item.type === 'stream') {
-                        return item.text;
-                    } else if (item.type === 'execute_result') {
-                        return item.text;
-                    } // if type
-                    return '';
-                }).join('');
-
-                outputContainer.textContent = outputText;
-                outputContainer.classList.add('has-output');
+        let result = await response.json();
+
+        // An earlier prompt blocks the kernel. If it belongs to this cell, or
+        // to a cell no longer on the page, answer it here; otherwise point to
+        // the waiting cell, reopening its prompt if the reply was lost
+        const error = result.error;
+        if (result.status === 'error' && error && error.ename === 'KernelBusy' && error.pending_input) {
+            const pending = error.pending_input;
+            const waitingCell = findCellById(pending.cell_id);
+            if (waitingCell === cell || not(waitingCell)) {
+                result = { ...pending, status: 'input_requested' };
             } else {
-                outputContainer.textContent = '(No output)';
-            } // if output
-        } else if (result.status === 'error') {
-            // Display error
-            const error = result.error;
-            let errorText = `${error.ename}: ${error.evalue}`;
-
-            if (error.traceback && error.traceback.length > 0) {
-                errorText = error.traceback.join('\n');
-            } // if traceback
-
-            outputContainer.textContent = errorText;
-            outputContainer.classList.add('has-error');
-        } // if status
+                result = {
+                    ...result,
+                    error: { ...error, evalue: `Cell ${getCellIndex(waitingCell) + 1} is waiting for input; answer or cancel it first` }
+                };
+                if (not(hasOpenPrompt(waitingCell))) resumeInput(waitingCell, pending);
+            } // if waiting cell
+        } // if prompt pending
+
+        result = await answerInputRequests(cell, result);
+        showExecutionResult(cell, result);
 
     } catch (error) {
         console.error('Error executing cell:', error);
+        outputHashes.delete(cell);
         outputContainer.textContent = `Error: ${error.message}`;
         outputContainer.classList.add('has-error');
     } finally {
@@ -494,10 +668,475 @@ async function executeCell(cell) {
     } // try
 } // executeCell
 
+// The cell may stop to ask for input any number of times
+async function answerInputRequests(cell, result) {
+    while (result.status === 'input_requested') {
+        outputHashes.delete(cell);
+        displayExecutionResult(getOutputContainer(cell), result);
+        const answer = await askForInput(cell, result.prompt, result.password);
+
+        const inputResponse = await fetch(`${API_BASE}/input`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ execution_id: result.execution_id, ...answer })
+        });
+        result = await inputResponse.json();
+    } // while input requested
+
+    return result;
+} // answerInputRequests
+
+function showExecutionResult(cell, result) {
+    const outputContainer = getOutputContainer(cell);
+
+    if (result.diff) {
+        displayOutputDiff(outputContainer, result);
+        outputHashes.set(cell, result.diff.hash);
+    } else {
+        outputHashes.delete(cell);
+        displayExecutionResult(outputContainer, result);
+    } // if diff
+    let outputs = result.outputs;
+    if (result.outputs_diff) {
+        const saved = cellOutputs.get(cell);
+        outputs = applyOutputsDiff(saved ? saved.outputs : [], result.outputs_diff);
+    } // if outputs diff
+    if (outputs) {
+        cellOutputs.set(cell, {
+            outputs,
+            execution_count: result.execution_count ?? null,
+            timing: result.timing || {}
+        });
+    } // if outputs
+} // showExecutionResult
+
+// Patch text with [start, end, lines] operations on its lines
+function applyLineOps(text, ops) {
+    const oldLines = text.split('\n');
+    const lines = [];
+    let position = 0;
+    for (const [start, end, newLines] of ops) {
+        for (let i = position; i < start; i++) lines.push(oldLines[i]);
+        for (const line of newLines) lines.push(line);
+        position = end;
+    } // for op
+    for (let i = position; i < oldLines.length; i++) lines.push(oldLines[i]);
+    return lines.join('\n');
+} // applyLineOps
+
+// Rebuild a cell's nbformat outputs from the previous ones and an outputs
+// diff: per output, an index (unchanged), a patch, or the whole output
+function applyOutputsDiff(previous, outputsDiff) {
+    return outputsDiff.map(entry => {
+        if (typeof entry === 'number') return previous[entry];
+        if (entry.output) return entry.output;
+
+        const output = { ...previous[entry.index], ...(entry.set || {}) };
+        if (entry.ops) output.text = applyLineOps(output.text, entry.ops);
+        return output;
+    });
+} // applyOutputsDiff
+
+// After a reload, a cell may still be paused on input(); offer its prompt
+// again in that cell once the notebook containing it is loaded
+async function resumePendingInput() {
+    try {
+        const response = await fetch(`${API_BASE}/input`);
+        const pending = (await response.json()).pending_input;
+        if (not(pending)) return;
+
+        const cell = findCellById(pending.cell_id);
+        if (cell) await resumeInput(cell, pending);
+    } catch (error) {
+        console.error('Error resuming input request:', error);
+    } // try
+} // resumePendingInput
+
+async function resumeInput(cell, pending) {
+    try {
+        const result = await answerInputRequests(cell, { ...pending, status: 'input_requested' });
+        showExecutionResult(cell, result);
+    } catch (error) {
+        console.error('Error resuming input request:', error);
+    } // try
+} // resumeInput
+
+function findCellById(cellId) {
+    return getAllCells(notebookTable).find(cell => cell.dataset.cellId === cellId) || null;
+} // findCellById
+
+// The form askForInput puts below a cell's output
+function hasOpenPrompt(cell) {
+    const next = getOutputContainer(cell).nextElementSibling;
+    return Boolean(next && next.classList.contains('stdin'));
+} // hasOpenPrompt
+
+function focusPrompt(cell) {
+    getOutputContainer(cell).nextElementSibling.querySelector('input').focus();
+} // focusPrompt
+
+function outputToText(output) {
+    return output.map(item => {
+        if (item.type === 'stream') {
+            return item.text;
+        } else if (item.type === 'execute_result') {
+            return item.text;
+        } // if type
+        return '';
+    }).join('');
+} // outputToText
+
+function displayExecutionResult(outputContainer, result) {
+    outputContainer.classList.remove('has-output', 'has-error');
+
+    // Remove aria-live for code cells to prevent double speaking
+
+    // Display output
+    if (result.status === 'ok' || result.status === 'input_requested') {
+        if (result.output && result.output.length > 0) {
+            outputContainer.textContent = outputToText(result.output);
+            outputContainer.classList.add('has-output');
+        } else {
+            outputContainer.textContent = result.status === 'ok' ? '(No output)' : '';
+        } // if output
+    } else if (result.status === 'error') {
+        // Display error
+        const error = result.error;
+        let errorText = `${error.ename}: ${error.evalue}`;
+
+        if (error.traceback && error.traceback.length > 0) {
+            errorText = error.traceback.join('\n');
+        } // if traceback
+
+        const outputText = result.output ? outputToText(result.output) : '';
+        outputContainer.textContent = outputText ? `${outputText}\n${errorText}` : errorText;
+        outputContainer.classList.add('has-error');
+    } // if status
+} // displayExecutionResult
+
+// Output shown as one span per line, so a diff can replace just the lines
+// that changed; each line but the last keeps its newline
+function createOutputLine(line, isLast) {
+    const span = document.createElement('span');
+    span.className = 'output-line';
+    span.textContent = isLast ? line : `${line}\n`;
+    return span;
+} // createOutputLine
+
+function setOutputLineLast(span, isLast) {
+    const line = span.textContent.replace(/\n$/, '');
+    span.textContent = isLast ? line : `${line}\n`;
+} // setOutputLineLast
+
+// Apply a reply's diff: whole text, or [start, end, lines] operations
+// against the lines already shown
+function displayOutputDiff(outputContainer, result) {
+    const diff = result.diff;
+
+    if (typeof diff.text === 'string') {
+        const lines = diff.text.split('\n');
+        outputContainer.replaceChildren(...lines.map((line, i) => createOutputLine(line, i === lines.length - 1)));
+    } else {
+        const spans = [...outputContainer.children];
+        const oldLast = spans[spans.length - 1];
+
+        // Last to first, so earlier line numbers stay valid
+        for (const [start, end, lines] of [...diff.ops].reverse()) {
+            const next = spans[end] || null;
+            spans.slice(start, end).forEach(span => span.remove());
+            lines.forEach(line => outputContainer.insertBefore(createOutputLine(line, false), next));
+        } // for op
+
+        // Only the lines either side of the old and new end can need their newline changed
+        const newLast = outputContainer.lastElementChild;
+        if (oldLast && oldLast.isConnected && oldLast !== newLast) setOutputLineLast(oldLast, false);
+        if (newLast) setOutputLineLast(newLast, true);
+    } // if text
+
+    outputContainer.classList.remove('has-output', 'has-error');
+    if (result.status === 'error') {
+        outputContainer.classList.add('has-error');
+    } else if (result.status === 'ok' && outputContainer.textContent !== '(No output)') {
+        outputContainer.classList.add('has-output');
+    } // if status
+} // displayOutputDiff
+
+const ANSI_ESCAPE = /\x1b\[[0-9;]*m/g;
+
+function joinText(text) {
+    return Array.isArray(text) ? text.join('') : (text || '');
+} // joinText
+
+// Text of saved nbformat outputs, laid out the way executeCell shows live output
+function displaySavedOutputs(outputContainer, outputs) {
+    // Not drawn as output lines, so no diff can be applied to it
+    outputHashes.delete(findCell(outputContainer));
+    const text = outputs.map(output => {
+        if (output.output_type === 'stream') {
+            return joinText(output.text);
+        } else if (output.output_type === 'execute_result' && output.data) {
+            return joinText(output.data['text/plain']);
+        } // if type
+        return '';
+    }).join('');
+
+    const errors = outputs.filter(output => output.output_type === 'error')
+        .map(error => (error.traceback && error.traceback.length > 0)
+            ? error.traceback.join('\n').replace(ANSI_ESCAPE, '')
+            : `${error.ename}: ${error.evalue}`);
+
+    outputContainer.classList.remove('has-output', 'has-error');
+    if (errors.length > 0) {
+        outputContainer.textContent = text ? `${text}\n${errors.join('\n')}` : errors.join('\n');
+        outputContainer.classList.add('has-error');
+    } else if (text) {
+        outputContainer.textContent = text;
+        outputContainer.classList.add('has-output');
+    } else {
+        outputContainer.textContent = '(No output)';
+    } // if errors
+} // displaySavedOutputs
+
+// Shows the kernel's input() prompt below the cell output and resolves with
+// { value } when submitted, or { cancel: true } if cancelled.
+function askForInput(cell, prompt, password) {
+    return new Promise(resolve => {
+        const form = document.createElement('form');
+        form.className = 'stdin';
+
+        const label = document.createElement('label');
+        label.textContent = prompt || 'Input requested';
+        const input = document.createElement('input');
+        input.type = password ? 'password' : 'text';
+        input.autocomplete = 'off';
+        label.appendChild(input);
+
+        const sendBtn = document.createElement('button');
+        sendBtn.type = 'submit';
+        sendBtn.className = 'control-btn';
+        sendBtn.textContent = 'Send';
+        const cancelBtn = document.createElement('button');
+        cancelBtn.type = 'button';
+        cancelBtn.className = 'control-btn';
+        cancelBtn.textContent = 'Cancel';
+
+        form.append(label, sendBtn, cancelBtn);
+
+        const finish = answer => {
+            form.remove();
+            getOutputContainer(cell).focus();
+            resolve(answer);
+        }; // finish
+
+        form.addEventListener('submit', e => {
+            e.preventDefault();
+            finish({ value: input.value });
+        });
+        cancelBtn.addEventListener('click', () => finish({ cancel: true }));
+        form.addEventListener('keydown', e => {
+            if (e.key === 'Escape') finish({ cancel: true });
+        });
+
+        getOutputContainer(cell).insertAdjacentElement('afterEnd', form);
+        input.focus();
+    });
+} // askForInput
+
+// ============================================================================
+// Code Assistance (completion and inspection)
+// ============================================================================
+
+const MAX_ANNOUNCED_COMPLETIONS = 20;
+
+// Repeated shortcut presses collapse into a single request to the kernel
+const requestAssist = debounceAsync(async (endpoint, body) => {
+    const response = await fetch(`${API_BASE}/${endpoint}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(body)
+    });
+    return response.json();
+}, 150);
+
+function announceAssist(cell, text) {
+    const assistContainer = getAssistContainer(cell);
+    assistContainer.textContent = text;
+    assistContainer.hidden = not(text);
+} // announceAssist
+
+function commonPrefix(strings) {
+    if (strings.length === 0) return '';
+    let prefix = strings[0];
+    for (const s of strings) {
+        while (not(s.startsWith(prefix))) prefix = prefix.slice(0, -1);
+    } // for
+    return prefix;
+} // commonPrefix
+
+async function completeAtCursor(cell) {
+    if (not(isCodeCell(cell)) || not(isEditModeEnabled(cell))) return;
+
+    const codeContainer = getCodeContainer(cell);
+    const code = codeContainer.textContent;
+    const cursorPos = getCaretOffset(codeContainer);
+
+    const result = await requestAssist('complete', { code, cursor_pos: cursorPos });
+    if (not(result)) return;
+
+    if (result.status !== 'ok') {
+        announceAssist(cell, `Completion unavailable: ${result.message}`);
+        return;
+    } // if error
+
+    const matches = result.matches;
+    if (matches.length === 0) {
+        announceAssist(cell, 'No completions');
+        return;
+    } // if no matches
+
+    // Insert as much as is unambiguous; announce the rest
+    const replacement = matches.length === 1 ? matches[0] : commonPrefix(matches);
+    const typed = code.slice(result.cursor_start, result.cursor_end);
+    if (replacement.length > typed.length) {
+        codeContainer.textContent = code.slice(0, result.cursor_start) + replacement + code.slice(result.cursor_end);
+        setCaretOffset(codeContainer, result.cursor_start + replacement.length);
+    } // if something to insert
+
+    if (matches.length === 1) {
+        announceAssist(cell, `Completed ${matches[0]}`);
+    } else {
+        const shown = matches.slice(0, MAX_ANNOUNCED_COMPLETIONS).join(', ');
+        const more = matches.length > MAX_ANNOUNCED_COMPLETIONS ? `, and ${matches.length - MAX_ANNOUNCED_COMPLETIONS} more` : '';
+        announceAssist(cell, `${matches.length} completions: ${shown}${more}`);
+    } // if single match
+} // completeAtCursor
+
+async function inspectAtCursor(cell) {
+    if (not(isCodeCell(cell)) || not(isEditModeEnabled(cell))) return;
+
+    const codeContainer = getCodeContainer(cell);
+    const code = codeContainer.textContent;
+    const cursorPos = getCaretOffset(codeContainer);
+
+    const result = await requestAssist('inspect', { code, cursor_pos: cursorPos });
+    if (not(result)) return;
+
+    if (result.status !== 'ok') {
+        announceAssist(cell, `Documentation unavailable: ${result.message}`);
+    } else if (not(result.found)) {
+        announceAssist(cell, 'No documentation found');
+    } else {
+        announceAssist(cell, result.text);
+    } // if status
+} // inspectAtCursor
+
+// ============================================================================
+// Variable Inspector
+// ============================================================================
+
+const VARIABLES_PAGE_SIZE = 20;
+let variablesOffset = 0;
+
+function formatBytes(n) {
+    if (n < 1024) return `${n} bytes`;
+    if (n < 1024 * 1024) return `${(n / 1024).toFixed(1)} KB`;
+    if (n < 1024 * 1024 * 1024) return `${(n / (1024 * 1024)).toFixed(1)} MB`;
+    return `${(n / (1024 * 1024 * 1024)).toFixed(1)} GB`;
+} // formatBytes
+
+function describeVariableSize(variable) {
+    if (variable.shape) return `shape ${variable.shape.join(' by ')}`;
+    if (variable.length !== undefined) return `length ${variable.length}`;
+    return '';
+} // describeVariableSize
+
+function describeVariableContents(variable) {
+    const parts = [];
+    if (variable.dtype) parts.push(`dtype ${variable.dtype}`);
+    if (variable.columns) parts.push(`columns ${variable.columns.join(', ')}`);
+    if (variable.summary) parts.push(`min ${variable.summary.min}, max ${variable.summary.max}, mean ${variable.summary.mean}`);
+    if (variable.preview) parts.push(variable.preview);
+    return parts.join('; ');
+} // describeVariableContents
+
+function createVariablesDialog () {
+    const dialog = document.createElement("dialog");
+    dialog.id = "variables";
+    dialog.insertAdjacentHTML("beforeEnd", `
+    <div>
+    <h2>Variables</h2>
+    <button commandFor="variables" command="close">Close</button>
+    </div>
+    <p class="variables-status" role="status"></p>
+    <div><table class="content">
+    <thead><tr><th>name</th> <th>type</th> <th>size</th> <th>memory</th> <th>contents</th></tr></thead>
+    <tbody></tbody>
+    </table></div>
+    <div class="controls">
+    <button class="previous control-btn">Previous page</button>
+    <button class="next control-btn">Next page</button>
+    </div>
+    `); // dialog
+
+    dialog.querySelector(".previous").addEventListener("click", () => showVariables(variablesOffset - VARIABLES_PAGE_SIZE));
+    dialog.querySelector(".next").addEventListener("click", () => showVariables(variablesOffset + VARIABLES_PAGE_SIZE));
+    document.body.insertAdjacentElement("beforeEnd", dialog);
+    return dialog;
+} // createVariablesDialog
+
+async function showVariables (offset = 0) {
+    const status = variablesDialog.querySelector(".variables-status");
+    const tbody = variablesDialog.querySelector("tbody");
+    if (not(variablesDialog.open)) variablesDialog.showModal();
+
+    try {
+        const response = await fetch(`${API_BASE}/variables?offset=${Math.max(0, offset)}&limit=${VARIABLES_PAGE_SIZE}`);
+        const result = await response.json();
+
+        tbody.textContent = '';
+        if (result.status !== 'ok') {
+            status.textContent = `Variables unavailable: ${result.message}`;
+            return;
+        } // if error
+
+        variablesOffset = result.offset;
+        for (const variable of result.variables) {
+            const row = tbody.insertRow();
+            const name = document.createElement("th");
+            name.textContent = variable.name;
+            row.appendChild(name);
+            for (const text of [variable.type, describeVariableSize(variable), formatBytes(variable.memory), describeVariableContents(variable)]) {
+                row.insertCell().textContent = text;
+            } // for
+        } // for variable
+
+        const last = result.offset + result.variables.length;
+        status.textContent = result.total === 0
+            ? 'No variables defined'
+            : `Variables ${result.offset + 1} to ${last} of ${result.total}`;
+        variablesDialog.querySelector(".previous").disabled = result.offset === 0;
+        variablesDialog.querySelector(".next").disabled = last >= result.total;
+    } catch (error) {
+        console.error('Error fetching variables:', error);
+        status.textContent = `Error: ${error.message}`;
+    } // try
+} // showVariables
+
 // ============================================================================
 // Notebook File Functions
 // ============================================================================
 
+const CELL_ID = /^[a-zA-Z0-9_-]{1,64}$/;
+
+function newCellId() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + Math.random().toString(36).slice(2);
+} // newCellId
+
 function createCellElement(cellData) {
     const cellType = cellData.cell_type || 'code';
     const source = Array.isArray(cellData.source) ? cellData.source.join('') : (cellData.source || '');
@@ -506,6 +1145,8 @@ function createCellElement(cellData) {
     const row = document.createElement('tr');
     row.className = 'cell';
     row.dataset.type = cellType;
+    // nbformat 4.5 cell id; also names the cell to the server for output diffs
+    row.dataset.cellId = (typeof cellData.id === 'string' && CELL_ID.test(cellData.id)) ? cellData.id : newCellId();
 
     row.innerHTML = `
         <td class="toolbar">
@@ -531,6 +1172,7 @@ function createCellElement(cellData) {
             <div role="group" aria-label="${cellType === "code"? 'code' : ''}">
             <pre class="code" hidden contenteditable="true" spellcheck="false" tabindex="0">
             </pre>
+            <div class="assist" role="status" hidden></div>
             <!--<hr>-->
             <output class="output" tabindex="0">(No output yet)</output>
         </div></td>
@@ -539,6 +1181,16 @@ function createCellElement(cellData) {
     const codeContainer = row.querySelector('.code');
     codeContainer.textContent = source;
 
+    // Show saved results straight away instead of making the user re-run
+    if (cellType === 'code' && Array.isArray(cellData.outputs) && cellData.outputs.length > 0) {
+        displaySavedOutputs(getOutputContainer(row), cellData.outputs);
+        cellOutputs.set(row, {
+            outputs: cellData.outputs,
+            execution_count: cellData.execution_count ?? null,
+            timing: (cellData.metadata && cellData.metadata.execution) || {}
+        });
+    } // if saved outputs
+
     return row;
 } // createCellElement
 
@@ -554,6 +1206,7 @@ function cellToNotebookData(cellElement) {
     });
 
     const cellData = {
+        id: cellElement.dataset.cellId,
         cell_type: cellType,
         source: sourceLines,
         metadata: {}
@@ -561,8 +1214,12 @@ function cellToNotebookData(cellElement) {
 
     // Code cells have execution_count and outputs
     if (cellType === 'code') {
-        cellData.execution_count = null;
-        cellData.outputs = [];
+        const saved = cellOutputs.get(cellElement);
+        cellData.execution_count = saved ? saved.execution_count : null;
+        cellData.outputs = saved ? saved.outputs : [];
+        if (saved && Object.keys(saved.timing).length > 0) {
+            cellData.metadata.execution = saved.timing;
+        } // if timing
     } // if code
 
     return cellData;
@@ -574,6 +1231,7 @@ function clearNotebook() {
 
 function loadNotebookFromData(notebookData) {
     clearNotebook();
+    notebookMetadata = notebookData.metadata || {};
 
     if (not(notebookData.cells) || notebookData.cells.length === 0) {
         return;
@@ -586,6 +1244,10 @@ function loadNotebookFromData(notebookData) {
 
     //console.log(`Loaded ${notebookData.cells.length} cells`);
 
+    finishNotebookLoad();
+} // loadNotebookFromData
+
+function finishNotebookLoad() {
 
 runAllMarkdownCells();
 //console.log("ran all markdown cells");
@@ -594,9 +1256,70 @@ makeAllToolbarsUnfocusable();
 //console.log("toolbars unfocusable");
 
 currentCell = getCellByIndex(0);
-getOutputContainer(currentCell).focus();
+if (currentCell) getOutputContainer(currentCell).focus();
 //console.log("focused first cell");
-} // loadNotebookFromData
+
+useNotebookKernel();
+resumePendingInput();
+} // finishNotebookLoad
+
+// Notebooks bigger than this are streamed to the server, which stores them
+// and hands the cells back a page at a time.
+const LARGE_NOTEBOOK_BYTES = 5 * 1024 * 1024;
+const IMPORT_PAGE_SIZE = 100;
+
+// Stored name of each file imported this session, so opening the same file
+// again reads the stored copy instead of uploading it again
+const importedNotebooks = new Map();
+
+function importKey(file) {
+    return `${file.name}:${file.size}:${file.lastModified}`;
+} // importKey
+
+async function getImportedIndex(file) {
+    const name = importedNotebooks.get(importKey(file));
+    if (not(name)) return null;
+
+    const response = await fetch(`${API_BASE}/notebooks/${encodeURIComponent(name)}`);
+    if (not(response.ok)) {
+        importedNotebooks.delete(importKey(file));
+        return null;
+    } // if gone
+    return response.json();
+} // getImportedIndex
+
+async function importLargeNotebook(file) {
+    let index = await getImportedIndex(file);
+    if (not(index)) {
+        const response = await fetch(`${API_BASE}/notebooks/import?name=${encodeURIComponent(file.name)}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/octet-stream'
+            },
+            body: file
+        });
+        index = await response.json();
+        if (index.status !== 'ok') {
+            throw new Error(index.message || `Import failed (${response.status})`);
+        } // if error
+        importedNotebooks.set(importKey(file), index.name);
+    } // if not imported
+
+    clearNotebook();
+    notebookMetadata = index.metadata || {};
+    const name = encodeURIComponent(index.name);
+    for (let offset = 0; offset < index.cell_count; offset += IMPORT_PAGE_SIZE) {
+        const pageResponse = await fetch(`${API_BASE}/notebooks/${name}/cells?offset=${offset}&limit=${IMPORT_PAGE_SIZE}`);
+        const page = await pageResponse.json();
+        if (page.status !== 'ok') {
+            throw new Error(page.message || `Could not read cells (${pageResponse.status})`);
+        } // if error
+
+        page.cells.forEach(cellData => notebookTable.appendChild(createCellElement(cellData)));
+    } // for page
+
+    finishNotebookLoad();
+} // importLargeNotebook
 
 function getAllCells (notebookTable) {
     return [...notebookTable.querySelectorAll(".cell")];
@@ -638,6 +1361,24 @@ function handleFileLoad(e) {
     const file = e.target.files[0];
     if (not(file)) return;
 
+    if (file.size > LARGE_NOTEBOOK_BYTES) {
+        importLargeNotebook(file)
+            .then(() => {
+                currentNotebookName = file.name;
+                if (notebookNameDisplay) {
+                    notebookNameDisplay.textContent = currentNotebookName;
+                } // if display
+            })
+            .catch(error => {
+                console.error('Error importing notebook:', error);
+                alert(`Error loading notebook: ${error.message}`);
+            });
+
+        // Reset input so same file can be loaded again
+        e.target.value = '';
+        return;
+    } // if large
+
     const reader = new FileReader();
 
     reader.onload = function(event) {
@@ -669,25 +1410,92 @@ function handleFileLoad(e) {
     e.target.value = '';
 } // handleFileLoad
 
-function saveNotebook() {
+// The running kernel's kernelspec, else the one the notebook was loaded with
+function getKernelspecMetadata() {
+    const spec = kernelspecs[currentKernelName];
+    if (spec) {
+        return {
+            display_name: spec.display_name,
+            language: spec.language,
+            name: currentKernelName
+        };
+    } // if running
+
+    return notebookMetadata.kernelspec || {
+        display_name: 'Python 3',
+        language: 'python',
+        name: 'python3'
+    };
+} // getKernelspecMetadata
+
+function getNotebookData() {
     const cells = [...document.querySelectorAll('.cell')].map(cellToNotebookData);
+    const kernelspec = getKernelspecMetadata();
 
-    const notebookData = {
+    // language_info comes from the kernel that wrote the notebook; keep it
+    // only while the language is unchanged
+    const languageInfo = notebookMetadata.language_info;
+
+    return {
         cells: cells,
         metadata: {
-            kernelspec: {
-                display_name: 'Python 3',
-                language: 'python',
-                name: 'python3'
-            },
-            language_info: {
-                name: 'python',
-                version: '3.11.0'
-            }
+            ...notebookMetadata,
+            kernelspec: kernelspec,
+            language_info: languageInfo && languageInfo.name === kernelspec.language
+                ? languageInfo
+                : { name: kernelspec.language }
         },
         nbformat: 4,
         nbformat_minor: 5
     };
+} // getNotebookData
+
+// Large rich outputs (plots, ...) are kept on the server and only
+// referenced from cell outputs; they are not shown on the page, but a saved
+// file must carry them so it opens anywhere
+const BLOB_METADATA_KEY = 'accessible_notebooks_blobs';
+
+async function restoreBlobs(notebookData) {
+    let missing = 0;
+
+    for (const cellData of notebookData.cells) {
+        for (const output of (cellData.outputs || [])) {
+            const blobs = output.metadata && output.metadata[BLOB_METADATA_KEY];
+            if (not(blobs)) continue;
+
+            const remaining = {};
+            for (const [mimetype, digest] of Object.entries(blobs)) {
+                try {
+                    const response = await fetch(`${API_BASE}/blobs/${digest}`);
+                    if (not(response.ok)) throw new Error(`status ${response.status}`);
+                    const blob = await response.json();
+                    output.data = { ...output.data, [mimetype]: blob.data };
+                } catch (error) {
+                    remaining[mimetype] = digest;
+                    missing++;
+                } // try
+            } // for blob
+
+            const metadata = { ...output.metadata };
+            if (Object.keys(remaining).length > 0) {
+                metadata[BLOB_METADATA_KEY] = remaining;
+            } else {
+                delete metadata[BLOB_METADATA_KEY];
+            } // if remaining
+            output.metadata = metadata;
+        } // for output
+    } // for cell
+
+    return missing;
+} // restoreBlobs
+
+async function saveNotebook() {
+    // Copies, so restoring blobs leaves the outputs kept for each cell alone
+    const notebookData = JSON.parse(JSON.stringify(getNotebookData()));
+    const missing = await restoreBlobs(notebookData);
+    if (missing > 0) {
+        alert(`${missing} large output(s) are no longer on the server and were not saved; run their cells again to restore them.`);
+    } // if missing
 
     const json = JSON.stringify(notebookData, null, 1);
     const blob = new Blob([json], { type: 'application/json' });
@@ -704,6 +1512,48 @@ function saveNotebook() {
     //console.log(`Saved notebook: ${currentNotebookName}`);
 } // saveNotebook
 
+// Exports are rendered on the server in the background; poll until ready
+const EXPORT_POLL_MS = 250;
+
+async function exportNotebook(format) {
+    const button = format === 'html' ? exportHtmlBtn : exportTextBtn;
+    try {
+        button.disabled = true;
+
+        const notebookData = getNotebookData();
+        notebookData.metadata.title = currentNotebookName.replace(/\.ipynb$/, '');
+
+        const response = await fetch(`${API_BASE}/export`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ format, notebook: notebookData })
+        });
+        let job = await response.json();
+
+        while (job.status === 'ok' && job.state === 'pending') {
+            await new Promise(resolve => setTimeout(resolve, EXPORT_POLL_MS));
+            job = await (await fetch(`${API_BASE}/export/${job.job_id}`)).json();
+        } // while pending
+
+        if (job.status !== 'ok' || job.state !== 'done') {
+            throw new Error(job.message || 'Export failed');
+        } // if failed
+
+        const a = document.createElement('a');
+        a.href = `${API_BASE}/exports/${job.filename}?download_name=${encodeURIComponent(currentNotebookName)}`;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+    } catch (error) {
+        console.error('Error exporting notebook:', error);
+        alert(`Error exporting notebook: ${error.message}`);
+    } finally {
+        button.disabled = false;
+    } // try
+} // exportNotebook
+
 function newNotebook() {
     if (document.querySelectorAll('.cell').length > 0) {
         if (not(confirm('Create new notebook? Unsaved changes will be lost.'))) {
@@ -712,6 +1562,7 @@ function newNotebook() {
     } // if has cells
 
     clearNotebook();
+    notebookMetadata = {};
     addCell();
 
     currentNotebookName = 'Untitled.ipynb';
@@ -751,6 +1602,9 @@ const notebookActions = new Map([[
 	"addCell", 
 {function: addCell, help: "Add a new cell following currently focused cell"}
 ],[
+"showVariables", 
+{function: showVariables, help: "List variables defined in the kernel"}
+],[
 "keyboardHelp", 
 {function: displayKeyboardHelp, help: "Generate this help"}
 ]]); // notebookActions
@@ -800,6 +1654,12 @@ const keymap = new Map([[
 ], [
 "control v",
 {function: appendCell, help: "Insert clipboard contents after current cell"}
+], [
+"control .",
+{function: completeAtCursor, help: "Complete the name at the cursor; remaining choices are announced"}
+], [
+"control /",
+{function: inspectAtCursor, help: "Announce documentation for the name at the cursor"}
 ], [
 	"f1",
 {function: displayKeyboardHelp, help: "Show keyboard help; focus returns to the cell with focus when the shortcut was pressed"}
@@ -889,6 +1749,8 @@ function handleCellClick(e) {
     //console.log("handleCellClick: ", e.target);
     const cell = findCell(e.target);
 	if (not(cell)) return;
+	// Let the input() prompt form handle its own clicks
+	if (isInStdinForm(e.target)) return;
 
 	
 	e.preventDefault();
@@ -909,6 +1771,7 @@ function handleCellClick(e) {
 function handleCellKeydown(e) {
     const cell = findCell(e.target);
     if (not(cell)) return;
+    if (isInStdinForm(e.target)) return;
 
     const key = eventToKey(e);
     if (not(key)) return;
@@ -949,7 +1812,7 @@ if (cellTo !== cellFrom) {
 // ============================================================================
 
 // Kernel controls
-startKernelBtn.addEventListener('click', startKernel);
+startKernelBtn.addEventListener('click', () => startKernel());
 restartKernelBtn.addEventListener('click', restartKernel);
 shutdownKernelBtn.addEventListener('click', shutdownKernel);
 
@@ -957,6 +1820,8 @@ shutdownKernelBtn.addEventListener('click', shutdownKernel);
 if (notebookFileInput) notebookFileInput.addEventListener('change', handleFileLoad);
 if (saveNotebookBtn) saveNotebookBtn.addEventListener('click', saveNotebook);
 if (newNotebookBtn) newNotebookBtn.addEventListener('click', newNotebook);
+if (exportHtmlBtn) exportHtmlBtn.addEventListener('click', () => exportNotebook('html'));
+if (exportTextBtn) exportTextBtn.addEventListener('click', () => exportNotebook('text'));
 
 // Notebook table event delegation (all events bubble)
 
@@ -973,9 +1838,10 @@ if (notebookTable) {
 // ============================================================================
 
 const keyboardHelpDialog = createKeyboardHelpDialog (keymap);
-startKernel();
+const variablesDialog = createVariablesDialog();
+loadKernelspecs().then(() => startKernel());
 clearNotebook();
-checkStatus();
+subscribeToStatus();
 
 // wait a bit to give kernel time to start; prevents screen reader announcements from clashing
 setTimeout(() => document.querySelector("#notebook-file-input").focus(), 2000);